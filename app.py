@@ -1,105 +1,405 @@
 # app.py
 
+import os
+import time
+from io import BytesIO
 import streamlit as st
 import numpy as np
 import sympy as sp
 import pandas as pd
 import plotly.graph_objects as go
-from equations import parse_equation
-from solvers import real_solution, dynamic_ode_function
-from methods import euler_method, rk2_method, rk4_method
-from utils import percent_error, compare_methods, create_pdf_report
+from equations import parse_system, state_symbols, compile_quantity
+from methods import step_functions, embedded_pairs, method_orders, method_stages, symplectic_methods, numba_available
+from utils import compare_methods, create_pdf_report, downsample
+from pipeline import get_reference_curve, get_trajectories, error_statistics, conserved_drift, select_step_size, get_extrapolated_trajectory, parameter_sweep
+from solvers import reference_solvers, default_reference
+from instrumentation import collect_metrics, timed
+from jobs import JobQueue
+from export import export_trajectories
 
 st.set_page_config(layout="wide", page_title="Numerical ODE Solver", page_icon="🔢")
 
 # Sidebar Title
 st.sidebar.title("🔧 Numerical ODE Solver")
 
-@st.cache_data
-def get_real_solution(t0, tf, x0, equation_str):
-    ode_func = dynamic_ode_function(equation_str)
-    return real_solution(t0, tf, x0, ode_func)
+def components(x_values):
+    """
+    Yield (label suffix, values) for each state component of a trajectory.
+    """
+    if x_values.ndim == 1:
+        yield '', x_values
+    else:
+        for i in range(x_values.shape[1]):
+            yield f' y{i}', x_values[:, i]
+
+# How trajectories are drawn; the full-resolution arrays are still used for the error statistics
+default_display = {'max_points': 2000, 'downsampling': 'LTTB', 'webgl': False}
+
+def add_trace(fig, x, y, display, **kwargs):
+    """
+    Add a trace downsampled to display['max_points'] points, drawn with WebGL if requested.
+    Downsampled traces drop their markers, which would no longer sit on the steps.
+    """
+    x_plot, y_plot = downsample(x, y, display['max_points'], display['downsampling'])
+    if len(x_plot) < len(x) and kwargs.get('mode') == 'lines+markers':
+        kwargs['mode'] = 'lines'
+    trace_type = go.Scattergl if display['webgl'] else go.Scatter
+    fig.add_trace(trace_type(x=x_plot, y=y_plot, **kwargs))
 
 @st.cache_data
-def plot_solution_and_errors(_equation_str, x0, t0, tf, method, step_sizes):
-    # Parse the equation string to obtain the callable function
-    ode_func = dynamic_ode_function(_equation_str)
+def plot_solution_and_errors(_equation_str, x0, t0, tf, method, step_sizes, rtol=1e-6, atol=1e-9, use_jit=False, reference=None, display=None, conserved=None):
+    display = {**default_display, **(display or {})}
     
-    # Get real solution using the parsed equation
-    real_sol = get_real_solution(t0, tf, x0, _equation_str)
-    t_fine = np.linspace(t0, tf, 1000)
-    x_real = real_sol.sol(t_fine)[0]
+    # Real solution for plotting
+    t_fine, x_real = get_reference_curve(_equation_str, x0, t0, tf, step_sizes, reference)
     
     fig = go.Figure()
-    fig.add_trace(go.Scatter(x=t_fine, y=x_real, mode='lines', name='Real Solution', line=dict(color='gray', width=2, dash='dash')))
+    with timed('plotting'):
+        for label, values in components(x_real):
+            add_trace(fig, t_fine, values, display, mode='lines', name=f'Real Solution{label}', line=dict(color='gray', width=2, dash='dash'))
     
+    trajectories = get_trajectories(_equation_str, x0, t0, tf, method, step_sizes, rtol, atol, use_jit, reference)
+
     error_stats = []
-    for h in step_sizes:
-        t_values = np.linspace(t0, tf, int((tf - t0) / h) + 1)
-        
-        # Apply selected method
-        if method == 'Euler':
-            x_values = euler_method(ode_func, t_values, x0, h)
-        elif method == 'Runge-Kutta 2nd Order':
-            x_values = rk2_method(ode_func, t_values, x0, h)
-        elif method == 'Runge-Kutta 4th Order':
-            x_values = rk4_method(ode_func, t_values, x0, h)
-        
+    for h, name, t_values, x_values, x_real_at_steps in trajectories:
         # Add to plot
-        fig.add_trace(go.Scatter(x=t_values, y=x_values, mode='lines+markers', name=f'{method} (h={h})'))
+        with timed('plotting'):
+            for label, values in components(x_values):
+                add_trace(fig, t_values, values, display, mode='lines+markers', name=f'{name}{label}')
         
-        # Calculate error statistics
-        x_real_at_steps = real_sol.sol(t_values)[0]
-        errors = percent_error(x_real_at_steps, x_values)
-        mean_error = np.mean(errors)
-        max_error = np.max(errors)
-        if pd.notna(mean_error) and pd.notna(max_error):
-            error_stats.append((h, mean_error, max_error))
+        # Calculate error statistics over every component
+        stats = error_statistics(x_real_at_steps, x_values)
+        if stats is not None:
+            if conserved:
+                stats = stats + conserved_drift(conserved, t_values, x_values)
+            error_stats.append((h,) + stats)
     
     fig.update_layout(title=f'Solution of ODE ({_equation_str}) with {method}', xaxis_title='Time t', yaxis_title='Solution x(t)')
-    error_df = pd.DataFrame(error_stats, columns=["Step Size", "Mean Error (%)", "Max Error (%)"])
+    columns = ["Step Size", "Mean Error (%)", "Max Error (%)"] + (["Conserved Drift (%)", "Conserved Drift (abs)"] if conserved else [])
+    error_df = pd.DataFrame(error_stats, columns=columns)
     
     return fig, error_df
 
+@st.cache_data
+def choose_step_size(equation_str, x0, t0, tf, method, target_error, target_statistic):
+    """
+    pipeline.select_step_size, cached so that reruns while polling jobs do not repeat it.
+    """
+    return select_step_size(equation_str, x0, t0, tf, method, target_error, target_statistic)
+
+@st.cache_resource
+def get_job_queue():
+    """
+    One background job queue per server, shared by every session, so that
+    identical requests from different users run only once.
+    """
+    return JobQueue(max_workers=max(1, (os.cpu_count() or 2) // 2))
+
+def show_job_progress(job_queue, job_id, method, display):
+    """
+    Show the progress of a running job with its partial trajectory and a cancel button.
+    """
+    if st.button(f"Cancel {method}", key=f"cancel_{job_id}"):
+        job_queue.cancel(job_id)
+    status = job_queue.status(job_id)
+    st.progress(status['fraction'], text=f"{method}: {status['label']} ({status['fraction']:.0%})")
+    if status['partial'] is not None:
+        t_values, x_values = status['partial']
+        fig = go.Figure()
+        for label, values in components(x_values):
+            add_trace(fig, t_values, values, display, mode='lines', name=f"{status['label']}{label}")
+        fig.update_layout(title=f'Partial solution with {method}', xaxis_title='Time t', yaxis_title='Solution x(t)')
+        st.plotly_chart(fig)
+
+def show_metrics(metrics):
+    """
+    Show the timings and counters of this run in the sidebar.
+    Cached results skip the instrumented stages, so they report nothing.
+    """
+    with st.sidebar.expander("⏱️ Performance Metrics"):
+        if metrics.timings:
+            st.table(pd.DataFrame(
+                [(stage, f"{seconds * 1000:.1f}") for stage, seconds in metrics.timings.items()],
+                columns=["Stage", "Time (ms)"]
+            ))
+        if metrics.counters:
+            st.table(pd.DataFrame(list(metrics.counters.items()), columns=["Counter", "Value"]))
+        if not metrics.timings and not metrics.counters:
+            st.write("Everything was served from cache.")
+        st.json(metrics.as_dict(), expanded=False)
+
+# Largest parameter grid a sweep may expand to, and how many of its solutions are plotted
+MAX_SWEEP_SIZE = 10000
+MAX_SWEEP_TRACES = 50
+
+def parameter_grid(parameters_str):
+    """
+    Parse 'a=1, b=0.5:2:16' into parameter names and the (m, k) grid of every
+    combination, where start:stop:count is an evenly spaced range.
+    """
+    names, axes = [], []
+    for item in parameters_str.split(','):
+        name, _, value = item.partition('=')
+        bounds = [float(part) for part in value.split(':')]
+        if len(bounds) == 3 and bounds[2] >= 1:
+            axes.append(np.linspace(bounds[0], bounds[1], int(bounds[2])))
+        elif len(bounds) == 1:
+            axes.append(np.array(bounds))
+        else:
+            raise ValueError(f"Expected name=value or name=start:stop:count, got '{item.strip()}'")
+        names.append(name.strip())
+    if np.prod([len(axis) for axis in axes]) > MAX_SWEEP_SIZE:
+        raise ValueError(f"Parameter sweeps are limited to {MAX_SWEEP_SIZE} combinations")
+    grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, len(axes))
+    return tuple(names), grid
+
+def show_parameter_sweep(equation_str, parameters, grid, x0, t0, tf, n, display):
+    """
+    Integrate every parameter combination in one batch and show the
+    trajectories and a table of final values, with dy/dp if requested.
+    """
+    st.subheader("📈 Parameter Sweep")
+    method = st.selectbox("Sweep Method:", list(method_stages), list(method_stages).index('Runge-Kutta 4th Order'))
+    h = st.selectbox("Sweep Step Size (h):", [0.1, 0.05, 0.01, 0.005], 2)
+    sensitivities = st.checkbox("Compute sensitivities dy/dp", False,
+                                help="Integrates the forward sensitivity equations, derived symbolically, along with the solution.")
+    try:
+        t_values, x_values, s_values = parameter_sweep(equation_str, parameters, grid, x0, t0, tf, method, h, sensitivities)
+    except ValueError as error:
+        st.error(str(error))
+        return
+
+    labels = [", ".join(f"{name}={value:g}" for name, value in zip(parameters, row)) for row in grid]
+    fig = go.Figure()
+    with timed('plotting'):
+        # Only the first combinations are drawn; the table lists all of them
+        for i in range(min(len(grid), MAX_SWEEP_TRACES)):
+            for label, values in components(x_values[:, i]):
+                add_trace(fig, t_values, values, display, mode='lines', name=f'{labels[i]}{label}')
+    fig.update_layout(title=f'Solutions with {method} (h={h})', xaxis_title='Time t', yaxis_title='Solution x(t)')
+    st.plotly_chart(fig)
+    if len(grid) > MAX_SWEEP_TRACES:
+        st.caption(f"Showing the first {MAX_SWEEP_TRACES} of {len(grid)} parameter combinations.")
+
+    table = pd.DataFrame(grid, columns=list(parameters))
+    final = x_values[-1].reshape(len(grid), n)
+    for i in range(n):
+        table[f"y{i if n > 1 else ''}(tf)"] = final[:, i]
+    if s_values is not None:
+        final_s = s_values[-1].reshape(len(grid), n, len(parameters))
+        for i in range(n):
+            for j, name in enumerate(parameters):
+                table[f"dy{i if n > 1 else ''}/d{name}(tf)"] = final_s[:, i, j]
+    st.dataframe(table)
+
 def main():
+    with collect_metrics() as metrics:
+        solver_page()
+    show_metrics(metrics)
+
+def solver_page():
     st.title("🔢 Numerical ODE Solver")
     
     # Take ODE input as string from user
-    equation_str = st.text_input("Enter the ODE function in terms of y and t:", "np.sin(t) - y**2")
+    equation_str = st.text_input(
+        "Enter the ODE function in terms of y and t:", "np.sin(t) - y**2",
+        help="Allowed: numbers, t, y, pi, e, + - * / ** and sin, cos, tan, arcsin, arccos, arctan, sinh, cosh, tanh, "
+             "exp, log, sqrt, abs, sign, floor, ceil, min, max, where(condition, a, b) and "
+             "piecewise(condition1, value1, ..., default), optionally written as np.sin etc. "
+             "For a system, separate the equations with ';' and write the components as y0, y1, ... "
+             "(e.g. Lotka-Volterra: 1.1*y0 - 0.4*y0*y1; 0.1*y0*y1 - 0.4*y1). "
+             "Higher-order equations are reduced to first order, e.g. y'' = -y becomes y1; -y0. "
+             "Named parameters such as a and b in a*sin(t) - b*y**2 are declared below."
+    )
     
-    # Parse the equation to get a sympy expression and the numpy equivalent
-    equation_sympy = parse_equation(equation_str)
+    # Named parameters turn the page into a sweep over their values
+    parameters_str = st.text_input(
+        "Parameters (optional):", "",
+        help="Comma-separated name=value or name=start:stop:count entries, e.g. a=1, b=0.5:2:16. "
+             "Every combination is integrated in one vectorized batch."
+    ).strip()
+    parameters, grid = (), None
+    if parameters_str:
+        try:
+            parameters, grid = parameter_grid(parameters_str)
+        except ValueError as error:
+            st.error(f"Invalid parameters: {error}")
+            return
+    
+    # Parse the equation to get a sympy expression for each component
+    try:
+        with timed('parse'):
+            equation_sympy = parse_system(equation_str, parameters)
+    except ValueError as error:
+        st.error(f"Invalid equation: {error}")
+        return
     
     # Display parsed equation as LaTeX
-    st.latex(r"f(t, y) = " + sp.latex(equation_sympy))
+    if len(equation_sympy) == 1:
+        st.latex(r"f(t, y) = " + sp.latex(equation_sympy[0]))
+    else:
+        st.latex(r"\begin{aligned}" + r" \\ ".join(
+            sp.latex(symbol) + r"' &= " + sp.latex(expr) for symbol, expr in zip(state_symbols(len(equation_sympy)), equation_sympy)
+        ) + r"\end{aligned}")
     
     # Sidebar inputs for initial condition and time range
-    x0 = st.sidebar.slider("Initial Condition (y(0)):", -10.0, 10.0, 1.0)
+    if len(equation_sympy) == 1:
+        x0 = st.sidebar.slider("Initial Condition (y(0)):", -10.0, 10.0, 1.0)
+    else:
+        x0_str = st.sidebar.text_input("Initial Conditions (y0(0), y1(0), ...):", ", ".join(["1.0"] * len(equation_sympy)))
+        try:
+            x0 = tuple(float(value) for value in x0_str.split(','))
+        except ValueError:
+            x0 = ()
+        if len(x0) != len(equation_sympy):
+            st.error(f"Expected {len(equation_sympy)} comma-separated initial conditions.")
+            return
     t0 = st.sidebar.slider("Initial Time (t0):", 0.0, 5.0, 0.0)
     tf = st.sidebar.slider("Final Time (tf):", 0.1, 5.0, 1.0)
     
+    if parameters:
+        show_parameter_sweep(equation_str, parameters, grid, x0, t0, tf, len(equation_sympy), default_display)
+        return
+    
     # Method and step size selection
-    methods = st.sidebar.multiselect("Numerical Methods:", ["Euler", "Runge-Kutta 2nd Order", "Runge-Kutta 4th Order"], ["Euler"])
-    step_sizes = st.sidebar.multiselect("Step Sizes (h):", [0.1, 0.05, 0.01, 0.005], [0.1, 0.05, 0.01])
+    methods = st.sidebar.multiselect("Numerical Methods:", list(step_functions) + list(embedded_pairs), ["Euler"])
+    # Either a manual sweep over step sizes or one predicted step size per method
+    auto_step = st.sidebar.checkbox("Choose step size for a target error", False,
+                                    help="Estimate the error from two coarse runs (Richardson) and run only the "
+                                         "largest step size predicted to meet the target.")
+    if auto_step:
+        target_error = st.sidebar.number_input("Target Error (%):", min_value=1e-8, max_value=100.0, value=0.1, format="%.2e")
+        target_statistic = st.sidebar.selectbox("Target Statistic:", ["Mean", "Max"])
+        extrapolate = st.sidebar.checkbox("Show Richardson extrapolation", False)
+        step_sizes = []
+    else:
+        step_sizes = st.sidebar.multiselect("Step Sizes (h):", [0.1, 0.05, 0.01, 0.005], [0.1, 0.05, 0.01])
+    
+    # Optional invariant, e.g. the energy of a Hamiltonian system, whose drift is reported next to the errors
+    conserved = st.sidebar.text_input(
+        "Conserved Quantity (optional):", "",
+        help="A function of t and the state that the exact solution conserves, e.g. the energy "
+             "0.5*y1**2 + 0.5*y0**2 of y1; -y0. Symplectic methods expect the positions first and the momenta second."
+    ).strip()
+    if conserved:
+        try:
+            compile_quantity(conserved, len(equation_sympy))
+        except ValueError as error:
+            st.error(f"Invalid conserved quantity: {error}")
+            return
+    
+    # Tolerances for the adaptive methods
+    rtol, atol = 1e-6, 1e-9
+    if any(method in embedded_pairs for method in methods):
+        rtol = st.sidebar.number_input("Relative Tolerance (rtol):", min_value=1e-12, max_value=1e-1, value=rtol, format="%.1e")
+        atol = st.sidebar.number_input("Absolute Tolerance (atol):", min_value=1e-14, max_value=1e-1, value=atol, format="%.1e")
+    
+    # Compiled stepping loops are only offered when Numba is installed
+    use_jit = numba_available and st.sidebar.checkbox("Use compiled (Numba) kernels", True)
+    
+    # Long solves run in a shared process pool while this page polls for progress
+    background = st.sidebar.checkbox("Run solves in the background", True,
+                                     help="Keeps the page responsive during long solves and shows partial results.")
+    
+    # Plot payload controls for long trajectories
+    with st.sidebar.expander("Plot Rendering"):
+        display = {
+            'max_points': st.number_input("Max points per trace:", min_value=100, max_value=100000, value=default_display['max_points'], step=100),
+            'downsampling': st.selectbox("Downsampling:", ["LTTB", "Min-Max", "None"]),
+            'webgl': st.checkbox("WebGL rendering (Scattergl)", default_display['webgl']),
+        }
+    
+    # Settings for the accurate solution the errors are measured against
+    with st.sidebar.expander("Reference Solution"):
+        reference = {
+            'solver': st.selectbox("Solver:", reference_solvers, reference_solvers.index(default_reference['solver']),
+                                   help="Use Radau, BDF or LSODA for stiff equations."),
+            'rtol': st.number_input("Reference rtol:", min_value=1e-13, max_value=1e-2, value=default_reference['rtol'], format="%.1e"),
+            'atol': st.number_input("Reference atol:", min_value=1e-15, max_value=1e-2, value=default_reference['atol'], format="%.1e"),
+        }
     
     error_stats_dict = {}
     method_plots = {}
+    method_runs = {}
 
-    if methods and step_sizes:
+    # Fixed-step methods need at least one step size, adaptive ones choose their own
+    methods = [method for method in methods if step_sizes or auto_step or method in embedded_pairs]
+    if methods:
+        waiting = False
         for method in methods:
-            fig, error_df = plot_solution_and_errors(equation_str, x0, t0, tf, method, step_sizes)
+            if method in symplectic_methods and len(equation_sympy) % 2:
+                st.warning(f"{method} needs a system with an even number of components: positions followed by momenta.")
+                continue
+            method_step_sizes = step_sizes
+            if auto_step and method in method_orders:
+                try:
+                    h, predicted = choose_step_size(equation_str, x0, t0, tf, method, target_error, target_statistic)
+                except ValueError as error:
+                    st.error(str(error))
+                    continue
+                method_step_sizes = [h]
+
+            if background:
+                request = {
+                    'equation_str': equation_str, 'x0': x0, 't0': t0, 'tf': tf, 'method': method,
+                    'step_sizes': method_step_sizes + ([2 * h] if auto_step and extrapolate and method in method_orders else []),
+                    'rtol': rtol, 'atol': atol, 'use_jit': use_jit, 'reference': reference,
+                }
+                job_queue = get_job_queue()
+                job_id = job_queue.submit(request)
+                state = job_queue.state(job_id)
+                if state in ('pending', 'running'):
+                    show_job_progress(job_queue, job_id, method, display)
+                    waiting = True
+                    continue
+                if state == 'cancelled':
+                    st.warning(f"{method} was cancelled.")
+                    if st.button(f"Restart {method}", key=f"restart_{job_id}"):
+                        job_queue.submit(request, restart=True)
+                        st.rerun()
+                    continue
+                if state == 'failed':
+                    st.error(f"{method} failed: {job_queue.error(job_id)}")
+                    if st.button(f"Retry {method}", key=f"retry_{job_id}"):
+                        job_queue.submit(request, restart=True)
+                        st.rerun()
+                    continue
+
+            try:
+                fig, error_df = plot_solution_and_errors(equation_str, x0, t0, tf, method, method_step_sizes, rtol, atol, use_jit, reference, display, conserved)
+            except RuntimeError as error:
+                # Solver failures such as non-converging Newton iterations in implicit methods
+                st.error(f"{method} failed: {error}")
+                continue
+
+            if auto_step and method in method_orders:
+                message = f"{method}: predicted h = {h:.3g} for a {target_statistic.lower()} error of {predicted:.3g}%"
+                if extrapolate:
+                    t_values, x_extrapolated, x_real_at_steps = get_extrapolated_trajectory(equation_str, x0, t0, tf, method, h, reference)
+                    for label, values in components(x_extrapolated):
+                        add_trace(fig, t_values, values, display, mode='lines', name=f'Richardson extrapolation (h={h:.3g}){label}',
+                                  line=dict(dash='dot'))
+                    stats = error_statistics(x_real_at_steps, x_extrapolated)
+                    if stats is not None:
+                        message += f"; extrapolated result: mean {stats[0]:.3g}%, max {stats[1]:.3g}%"
+                st.caption(message)
             st.plotly_chart(fig)
             
             # Collect error stats for comparison and plots for the report
-            error_stats_dict[method] = [(row['Step Size'], row['Mean Error (%)'], row['Max Error (%)']) for _, row in error_df.iterrows()]
+            error_stats_dict[method] = list(error_df.itertuples(index=False, name=None))
             method_plots[method] = fig
+            method_runs[method] = method_step_sizes
         
+        # Poll running jobs by rerunning the page; finished methods render from the cache
+        if waiting:
+            time.sleep(0.5)
+            st.rerun()
+
         # Compare methods if there are valid error stats
         compare_methods(error_stats_dict)
 
         # Generate PDF Report Button
         if st.button("Download PDF Report"):
-            method_plots = {method: fig for method in methods}  # Collect all generated plots
             pdf_report = create_pdf_report(equation_str, error_stats_dict, method_plots)
             st.download_button(
                 label="Download Report",
@@ -108,5 +408,31 @@ def main():
                 mime="application/pdf"
             )
 
+        # Every step of every trajectory, for analysis outside the app
+        export_format = st.selectbox("Trajectory Export Format:", ["Arrow", "Parquet"],
+                                     help="Arrow IPC files can be memory-mapped with export.read_trajectories; Parquet files are smaller.")
+        if st.button("Export Trajectories"):
+            trajectories = [
+                (method, h, t_values, x_values, x_real)
+                for method, method_step_sizes in method_runs.items()
+                for h, _, t_values, x_values, x_real in get_trajectories(
+                    equation_str, x0, t0, tf, method, method_step_sizes, rtol, atol, use_jit, reference
+                )
+            ]
+            export_buffer = BytesIO()
+            try:
+                export_trajectories(export_buffer, trajectories, export_format.lower(),
+                                    {'equation': equation_str, 'x0': x0, 't0': t0, 'tf': tf, 'reference': reference})
+            except ImportError:
+                st.error("Exporting trajectories requires pyarrow.")
+            else:
+                extension = 'arrow' if export_format == 'Arrow' else 'parquet'
+                st.download_button(
+                    label="Download Trajectories",
+                    data=export_buffer.getvalue(),
+                    file_name=f"ODE_Trajectories.{extension}",
+                    mime="application/octet-stream"
+                )
+
 if __name__ == "__main__":
     main()
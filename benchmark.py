@@ -0,0 +1,172 @@
+# benchmark.py
+
+"""
+Convergence-order and work-precision benchmark for the methods in methods.py.
+
+For every fixed-step method the step size is halved repeatedly; for every
+adaptive pair the tolerance is tightened. Each run records wall time, number
+of right-hand side evaluations, peak memory and the max error against a
+tight reference solution. The observed convergence order of the fixed-step
+methods is the slope of log(error) against log(h).
+
+Usage:
+    python benchmark.py --equation "np.sin(t) - y**2" --tf 5 --output bench
+    python benchmark.py --output bench --baseline bench/benchmark.csv
+
+With --baseline, runs that got slower than the baseline by more than
+--max-slowdown are reported and the exit status is 1.
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from functools import partial
+from equations import compile_jacobian, split_system
+from solvers import dynamic_ode_function, reference_values
+from methods import method_functions, method_orders, implicit_methods, symplectic_methods, embedded_pairs, adaptive_method, time_grid
+from instrumentation import CountingFunction
+
+def measure(run, f, repeats):
+    """
+    Run run(counted_f) and return (result, best wall time, RHS evaluations, peak bytes).
+    Timing is the best of several repeats without tracemalloc, which slows
+    allocation down; peak memory comes from one extra traced run.
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        counted = CountingFunction(f)
+        start = time.perf_counter()
+        result = run(counted)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    run(f)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, counted.calls, peak
+
+def max_error(f, t0, x0, t_values, x_values, reference):
+    x_real = reference_values(f, t0, x0, t_values, **reference)
+    return float(np.max(np.abs(x_real - x_values)))
+
+def observed_orders(df):
+    """
+    Least-squares slope of log(error) against log(h) for each fixed-step method.
+    """
+    orders = {}
+    for method, group in df[df['kind'] == 'fixed'].groupby('method'):
+        group = group[group['max_error'] > 0]
+        if len(group) >= 2:
+            orders[method] = float(np.polyfit(np.log(group['step_size']), np.log(group['max_error']), 1)[0])
+    return orders
+
+def run_benchmark(equation_str, x0, t0, tf, methods, h_max, levels, tolerances, repeats, reference):
+    f = dynamic_ode_function(equation_str)
+    rows = []
+
+    for method in methods:
+        if method in embedded_pairs:
+            for tol in tolerances:
+                run = lambda g: adaptive_method(g, t0, tf, x0, method, rtol=tol, atol=tol * 1e-3)
+                (t_values, x_values, h_values), seconds, evaluations, peak = measure(run, f, repeats)
+                rows.append({
+                    'method': method, 'kind': 'adaptive', 'step_size': float(np.mean(h_values)), 'tolerance': tol,
+                    'steps': len(h_values), 'seconds': seconds, 'rhs_evaluations': evaluations, 'peak_bytes': peak,
+                    'max_error': max_error(f, t0, x0, t_values, x_values, reference),
+                })
+        else:
+            integrate = method_functions[method]
+            if method in implicit_methods:
+                integrate = partial(integrate, jac=compile_jacobian(equation_str))
+            for level in range(levels):
+                h = h_max / 2 ** level
+                t_values = time_grid(t0, tf, h)
+                run = lambda g: integrate(g, t_values, x0, h)
+                x_values, seconds, evaluations, peak = measure(run, f, repeats)
+                rows.append({
+                    'method': method, 'kind': 'fixed', 'step_size': h, 'tolerance': np.nan,
+                    'steps': len(t_values) - 1, 'seconds': seconds, 'rhs_evaluations': evaluations, 'peak_bytes': peak,
+                    'max_error': max_error(f, t0, x0, t_values, x_values, reference),
+                })
+
+    return pd.DataFrame(rows)
+
+def work_precision_figure(df, equation_str):
+    """
+    Plot max error against wall time and against RHS evaluations, one line per method.
+    """
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    fig = make_subplots(rows=1, cols=2, subplot_titles=("Error vs wall time", "Error vs RHS evaluations"))
+    for i, (method, group) in enumerate(df.groupby('method', sort=False)):
+        for col, x_column in enumerate(['seconds', 'rhs_evaluations'], start=1):
+            fig.add_trace(go.Scatter(
+                x=group[x_column], y=group['max_error'], mode='lines+markers', name=method,
+                legendgroup=method, showlegend=col == 1, line=dict(color=f'hsl({i * 57 % 360}, 65%, 45%)')
+            ), row=1, col=col)
+    fig.update_xaxes(type='log')
+    fig.update_yaxes(type='log', title_text='Max absolute error', col=1)
+    fig.update_xaxes(title_text='Wall time (s)', col=1)
+    fig.update_xaxes(title_text='RHS evaluations', col=2)
+    fig.update_layout(title=f'Work-precision diagram for {equation_str}')
+    return fig
+
+def compare_with_baseline(df, baseline, max_slowdown):
+    """
+    Return the rows whose wall time grew by more than max_slowdown against the baseline.
+    """
+    merged = df.merge(baseline, on=['method', 'step_size', 'tolerance'], suffixes=('', '_baseline'))
+    merged['slowdown'] = merged['seconds'] / merged['seconds_baseline']
+    return merged[merged['slowdown'] > max_slowdown]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convergence-order and work-precision benchmark.")
+    parser.add_argument('--equation', default="np.sin(t) - y**2", help="ODE right-hand side")
+    parser.add_argument('--x0', type=float, nargs='+', default=[1.0], help="initial condition (several values for a system)")
+    parser.add_argument('--t0', type=float, default=0.0)
+    parser.add_argument('--tf', type=float, default=5.0)
+    parser.add_argument('--methods', nargs='+', help="methods to compare (default: every method that fits the equation)")
+    parser.add_argument('--h-max', type=float, default=0.1, help="largest step size of the sweep")
+    parser.add_argument('--levels', type=int, default=6, help="number of step size halvings")
+    parser.add_argument('--tolerances', type=float, nargs='+', default=[1e-3, 1e-4, 1e-5, 1e-6, 1e-7, 1e-8])
+    parser.add_argument('--repeats', type=int, default=3, help="timing repeats, the best one is kept")
+    parser.add_argument('--reference-solver', default='DOP853')
+    parser.add_argument('--output', default='benchmark_results', help="directory for the CSV and the plot")
+    parser.add_argument('--baseline', help="previous benchmark.csv to check for performance regressions")
+    parser.add_argument('--max-slowdown', type=float, default=1.5)
+    args = parser.parse_args(argv)
+
+    x0 = args.x0[0] if len(args.x0) == 1 else np.array(args.x0)
+    methods = args.methods
+    if methods is None:
+        # Symplectic methods only apply to systems of positions and momenta
+        even_system = len(split_system(args.equation)) % 2 == 0
+        methods = [method for method in method_functions if even_system or method not in symplectic_methods] + list(embedded_pairs)
+    reference = {'solver': args.reference_solver, 'rtol': 1e-12, 'atol': 1e-14}
+    df = run_benchmark(args.equation, x0, args.t0, args.tf, methods, args.h_max,
+                       args.levels, args.tolerances, args.repeats, reference)
+
+    os.makedirs(args.output, exist_ok=True)
+    df.to_csv(os.path.join(args.output, 'benchmark.csv'), index=False)
+    work_precision_figure(df, args.equation).write_html(os.path.join(args.output, 'work_precision.html'))
+
+    print(df.to_string(index=False))
+    print("\nObserved convergence orders:")
+    for method, order in observed_orders(df).items():
+        print(f"  {method}: {order:.2f} (expected {method_orders.get(method, '?')})")
+
+    if args.baseline:
+        regressions = compare_with_baseline(df, pd.read_csv(args.baseline), args.max_slowdown)
+        if not regressions.empty:
+            print(f"\nRuns slower than baseline by more than {args.max_slowdown}x:")
+            print(regressions[['method', 'step_size', 'tolerance', 'seconds', 'seconds_baseline', 'slowdown']].to_string(index=False))
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import hashlib
+import os
+import tempfile
+import numpy as np
+
+# On-disk cache shared by every process that points at the same directory
+CACHE_DIR = os.environ.get("ODE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ode_solver"))
+CACHE_SIZE_LIMIT = int(os.environ.get("ODE_CACHE_SIZE_MB", "512")) * 1024 * 1024
+
+def cache_key(*parts):
+    """
+    Content-addressed key for a tuple of plain values (strings, numbers, tuples).
+    """
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+def array_digest(array):
+    """
+    Short content hash of an array, for use inside cache keys.
+    """
+    return hashlib.sha256(np.ascontiguousarray(array).tobytes()).hexdigest()[:16]
+
+def _cache_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.npz")
+
+def load_arrays(key):
+    """
+    Return the dict of arrays stored under key, or None on a miss.
+    A hit refreshes the file's modification time, which drives LRU eviction.
+    """
+    path = _cache_path(key)
+    try:
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        os.utime(path)
+        return arrays
+    except (OSError, ValueError):
+        # Missing, concurrently evicted or partially written entries are misses
+        return None
+
+def save_arrays(key, **arrays):
+    """
+    Store arrays under key as a compressed .npz file and enforce the size limit.
+    The file is written next to its final path and renamed into place, so
+    concurrent readers never see a partial entry.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            np.savez_compressed(tmp_file, **arrays)
+        os.replace(tmp_path, _cache_path(key))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    evict()
+
+def evict(limit=None):
+    """
+    Remove least recently used entries until the cache fits in limit bytes.
+    """
+    limit = CACHE_SIZE_LIMIT if limit is None else limit
+    if not os.path.isdir(CACHE_DIR):
+        return
+    entries = []
+    for entry in os.scandir(CACHE_DIR):
+        if entry.name.endswith(".npz"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # Already evicted by another process
+        total -= size
+
+def clear():
+    """
+    Remove every cached entry.
+    """
+    evict(limit=0)
@@ -0,0 +1,240 @@
+# cli.py
+
+"""
+Headless batch runner for the numerical ODE solver.
+
+Reads a JSON spec of equations, initial conditions, methods and step sizes,
+runs every configuration in a process pool and streams one row per
+trajectory to CSV or Parquet as results come in. Each row carries the
+timings and counters of its configuration as a JSON 'metrics' column.
+
+Example spec (a single object or a list of them):
+
+    {
+        "equations": ["np.sin(t) - y**2", "y1; -y0"],
+        "x0": [1.0, [1.0, 0.0]],
+        "t0": 0.0,
+        "tf": 5.0,
+        "methods": ["Euler", "Runge-Kutta 4th Order", "Dormand-Prince"],
+        "step_sizes": [0.1, 0.05, 0.01],
+        "rtol": 1e-6,
+        "atol": 1e-9,
+        "reference": {"solver": "Radau", "rtol": 1e-8, "atol": 1e-10},
+        "stream": {"chunk_size": 100000, "spill_dir": "spill"}
+    }
+
+Initial conditions are paired with equations by their number of components,
+so a scalar x0 only runs scalar equations and a list of length n only runs
+n-component systems.
+
+The optional "stream" entry integrates fixed-step methods in chunks with
+constant memory, for very long horizons. Only running mean/max errors are
+kept, unless "spill_dir" is given. In that case the full t, x, reference and
+error arrays of each step size are written as memory-mapped .npy files to a
+subdirectory listed in the 'spill_path' column.
+
+Usage:
+    python cli.py spec.json -o results.csv --workers 8
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+import numpy as np
+from equations import split_system, parse_system, compile_jit_equation
+from solvers import dynamic_ode_function
+from methods import embedded_pairs, implicit_methods, symplectic_methods
+from pipeline import get_trajectories, error_statistics, method_options
+from streaming import integrate_streaming
+from instrumentation import collect_metrics
+from cache import cache_key
+
+FIELDS = ['equation', 'x0', 't0', 'tf', 'method', 'step_size', 'steps', 'mean_error', 'max_error', 'metrics', 'spill_path']
+
+def expand_spec(spec):
+    """
+    Expand a spec (dict or list of dicts) into one task per equation, x0 and method.
+    Every equation is validated first, so bad input fails before any solving.
+    Combinations that cannot run, an x0 that does not match the number of
+    components or a symplectic method on an odd-sized system, are skipped
+    with a warning.
+    """
+    tasks = []
+    for entry in spec if isinstance(spec, list) else [spec]:
+        equations = entry['equations']
+        x0_values = entry['x0'] if isinstance(entry['x0'], list) else [entry['x0']]
+        for equation_str in equations:
+            try:
+                parse_system(equation_str)
+            except ValueError as error:
+                raise ValueError(f"Invalid equation '{equation_str}': {error}")
+        for equation_str, x0, method in product(equations, x0_values, entry['methods']):
+            n = len(split_system(equation_str))
+            if isinstance(x0, list) != (n > 1) or (n > 1 and len(x0) != n):
+                reason = f"x0 does not match the {n}-component equation"
+            elif method in symplectic_methods and n % 2:
+                reason = f"{method} needs an even number of components: positions followed by momenta"
+            else:
+                reason = None
+            if reason:
+                print(f"Skipped: {equation_str} x0={x0} {method}: {reason}", file=sys.stderr)
+                continue
+            tasks.append({
+                'equation_str': equation_str,
+                'x0': tuple(x0) if isinstance(x0, list) else float(x0),
+                't0': float(entry.get('t0', 0.0)),
+                'tf': float(entry.get('tf', 1.0)),
+                'method': method,
+                'step_sizes': [float(h) for h in entry.get('step_sizes', [])],
+                'rtol': float(entry.get('rtol', 1e-6)),
+                'atol': float(entry.get('atol', 1e-9)),
+                'reference': entry.get('reference'),
+                'stream': entry.get('stream'),
+            })
+    return tasks
+
+def result_row(task, h, steps, mean_error, max_error, metrics, spill_path=''):
+    return {
+        'equation': task['equation_str'],
+        'x0': json.dumps(task['x0']),
+        't0': task['t0'],
+        'tf': task['tf'],
+        'method': task['method'],
+        'step_size': float(h),
+        'steps': steps,
+        'mean_error': float(mean_error),
+        'max_error': float(max_error),
+        'metrics': json.dumps(metrics.as_dict()),
+        'spill_path': spill_path,
+    }
+
+def run_streaming_task(task):
+    """
+    Integrate every step size of a fixed-step configuration in chunks, keeping
+    only running error statistics unless the spec asks to spill the full
+    arrays to memory-mapped files.
+    """
+    options = task['stream']
+    ode_func = dynamic_ode_function(task['equation_str'])
+    # Implicit methods evaluate f on arrays in their Newton iterations, so they keep the NumPy function
+    jit_func = compile_jit_equation(task['equation_str']) if task['method'] not in implicit_methods else None
+    step_options = method_options(task['equation_str'], task['method'])
+    x0 = np.array(task['x0']) if isinstance(task['x0'], tuple) else task['x0']
+    rows = []
+    for h in task['step_sizes']:
+        spill_path = ''
+        if options.get('spill_dir'):
+            key = cache_key(task['equation_str'], task['x0'], task['t0'], task['tf'], task['method'], h)
+            spill_path = os.path.join(options['spill_dir'], key[:16])
+        with collect_metrics() as metrics:
+            # Stepping and the chunked reference solves are timed separately inside
+            stats = integrate_streaming(
+                ode_func, task['t0'], task['tf'], x0, h, task['method'], options.get('chunk_size', 100000),
+                task['reference'], spill_path or None, jit_func, step_options
+            )
+        steps = int((task['tf'] - task['t0']) / h + 1e-9)
+        rows.append(result_row(task, h, steps, stats.mean, stats.max, metrics, spill_path))
+    return rows
+
+def run_task(task):
+    """
+    Integrate one configuration and return its result rows.
+    """
+    if task['stream'] and task['method'] not in embedded_pairs:
+        return run_streaming_task(task)
+
+    with collect_metrics() as metrics:
+        trajectories = get_trajectories(
+            task['equation_str'], task['x0'], task['t0'], task['tf'], task['method'],
+            task['step_sizes'], task['rtol'], task['atol'], use_jit=True, reference=task['reference']
+        )
+        stats = [error_statistics(x_real, x_values) for _, _, _, x_values, x_real in trajectories]
+
+    rows = []
+    for (h, name, t_values, x_values, x_real), stats in zip(trajectories, stats):
+        mean_error, max_error = stats if stats is not None else (float('nan'), float('nan'))
+        rows.append(result_row(task, h, len(t_values) - 1, mean_error, max_error, metrics))
+    return rows
+
+class CsvSink:
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='') if path != '-' else sys.stdout
+        self.writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+        self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+class ParquetSink:
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema([
+            ('equation', pa.string()), ('x0', pa.string()), ('t0', pa.float64()), ('tf', pa.float64()),
+            ('method', pa.string()), ('step_size', pa.float64()), ('steps', pa.int64()),
+            ('mean_error', pa.float64()), ('max_error', pa.float64()), ('metrics', pa.string()), ('spill_path', pa.string()),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        # Each completed task becomes its own row group
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run batches of ODE configurations without the Streamlit UI.")
+    parser.add_argument('spec', help="JSON spec file")
+    parser.add_argument('-o', '--output', default='-', help="output file, '-' for CSV on stdout (default)")
+    parser.add_argument('--format', choices=['csv', 'parquet'], help="output format (default: from the file extension)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    with open(args.spec, 'r', encoding='utf-8') as file:
+        spec = json.load(file)
+    try:
+        tasks = expand_spec(spec)
+    except ValueError as error:
+        parser.error(str(error))
+
+    output_format = args.format or ('parquet' if args.output.endswith('.parquet') else 'csv')
+    if output_format == 'parquet':
+        if args.output == '-':
+            parser.error("Parquet output needs a file path")
+        try:
+            sink = ParquetSink(args.output)
+        except ImportError:
+            parser.error("Parquet output requires pyarrow")
+    else:
+        sink = CsvSink(args.output)
+
+    failures = 0
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = {executor.submit(run_task, task): task for task in tasks}
+            for future in as_completed(futures):
+                try:
+                    sink.write(future.result())
+                except Exception as error:
+                    failures += 1
+                    task = futures[future]
+                    print(f"Failed: {task['equation_str']} x0={task['x0']} {task['method']}: {error}", file=sys.stderr)
+    finally:
+        sink.close()
+
+    print(f"Completed {len(tasks) - failures} of {len(tasks)} configurations", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
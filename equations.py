@@ -1,19 +1,390 @@
+import ast
+import math
+import re
 import sympy as sp
 import numpy as np
+from functools import lru_cache
 
-# Mapping common math functions to SymPy equivalents
+# Functions allowed in ODE strings, written bare or with an np., numpy. or math. prefix
 sympy_functions = {
-    'sin': sp.sin,
-    'cos': sp.cos,
-    'exp': sp.exp,
-    'log': sp.log
+    'sin': sp.sin, 'cos': sp.cos, 'tan': sp.tan,
+    'arcsin': sp.asin, 'arccos': sp.acos, 'arctan': sp.atan,
+    'asin': sp.asin, 'acos': sp.acos, 'atan': sp.atan,
+    'sinh': sp.sinh, 'cosh': sp.cosh, 'tanh': sp.tanh,
+    'exp': sp.exp, 'log': sp.log, 'sqrt': sp.sqrt,
+    'abs': sp.Abs, 'sign': sp.sign, 'floor': sp.floor, 'ceil': sp.ceiling,
+    'min': sp.Min, 'max': sp.Max, 'minimum': sp.Min, 'maximum': sp.Max,
 }
 
-def parse_equation(equation_str):
-    # Replace 'np.' with '' so that sympy can understand the functions
-    for np_func, sympy_func in sympy_functions.items():
-        equation_str = equation_str.replace(f'np.{np_func}', np_func)
-    
-    # Parse the equation
-    return sp.sympify(equation_str, locals=sympy_functions)
+# Named constants allowed in ODE strings
+sympy_constants = {'pi': sp.pi, 'e': sp.E}
 
+# Longest accepted equation string, which also bounds the size of the syntax tree
+MAX_EQUATION_LENGTH = 1000
+
+# Largest number of decimal digits, positive or negative, of a constant power
+MAX_POWER_DIGITS = 308
+
+# Deepest accepted nesting of the syntax tree, which keeps the recursive
+# conversion, SymPy and the compiled code well within Python's recursion limit
+MAX_EQUATION_DEPTH = 100
+
+# Independent and state variables used in the ODE strings
+t_symbol, y_symbol = sp.symbols('t y', real=True)
+
+_binary_operators = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b,
+    ast.Pow: lambda a, b: _power(a, b),
+}
+
+_comparisons = {ast.Lt: sp.Lt, ast.LtE: sp.Le, ast.Gt: sp.Gt, ast.GtE: sp.Ge}
+
+def _power(base, exponent):
+    # Constant powers such as 9**9**9 would build huge integers when they are
+    # simplified or evaluated, so only those within the float range are allowed
+    if base.is_Number and exponent.is_Number and base != 0 and abs(base) != 1:
+        if abs(float(exponent)) * abs(math.log10(abs(float(base)))) > MAX_POWER_DIGITS:
+            raise ValueError(f"The constant power {base}**{exponent} is out of range")
+    return base ** exponent
+
+def _function_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id in ('np', 'numpy', 'math'):
+        return node.attr
+    raise ValueError("Only calls to the allowed math functions are supported")
+
+def _condition(node, parameters):
+    """
+    Convert a comparison, possibly combined with 'and'/'or', into a SymPy relational.
+    """
+    if isinstance(node, ast.BoolOp):
+        combine = sp.And if isinstance(node.op, ast.And) else sp.Or
+        return combine(*[_condition(value, parameters) for value in node.values])
+    if isinstance(node, ast.Compare):
+        terms = [_to_sympy(node.left, parameters)] + [_to_sympy(value, parameters) for value in node.comparators]
+        relations = []
+        for op, left, right in zip(node.ops, terms, terms[1:]):
+            if type(op) not in _comparisons:
+                raise ValueError("Conditions support only <, <=, > and >=")
+            relations.append(_comparisons[type(op)](left, right))
+        return sp.And(*relations)
+    raise ValueError("Expected a comparison such as y > 0 as condition")
+
+def _call(node, parameters):
+    name = _function_name(node.func)
+    if node.keywords:
+        raise ValueError(f"{name}() does not take keyword arguments")
+    if name in ('where', 'piecewise'):
+        # where(condition, a, b) and piecewise(condition1, value1, ..., default)
+        if len(node.args) % 2 == 0 or len(node.args) < 3:
+            raise ValueError(f"{name}() takes condition, value pairs followed by a default value")
+        pairs = [(_to_sympy(value, parameters), _condition(condition, parameters)) for condition, value in zip(node.args[:-1:2], node.args[1::2])]
+        return sp.Piecewise(*pairs, (_to_sympy(node.args[-1], parameters), True))
+    if name not in sympy_functions:
+        raise ValueError(f"Unknown function '{name}'")
+    try:
+        return sympy_functions[name](*[_to_sympy(arg, parameters) for arg in node.args])
+    except TypeError:
+        raise ValueError(f"Wrong number of arguments for {name}()")
+
+def _to_sympy(node, parameters=None):
+    """
+    Build the SymPy expression for a whitelisted Python syntax tree.
+    Anything but numbers, t, y, y0, y1, ..., the constants, the declared
+    parameters (a dict of name to symbol), arithmetic and calls to the
+    allowed functions is rejected with a ValueError.
+    """
+    parameters = parameters or {}
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return sp.Integer(node.value) if isinstance(node.value, int) else sp.Float(node.value)
+    if isinstance(node, ast.Name):
+        if node.id == 't':
+            return t_symbol
+        if node.id == 'y':
+            return y_symbol
+        if re.fullmatch(r'y\d+', node.id):
+            return sp.Symbol(node.id, real=True)
+        if node.id in sympy_constants:
+            return sympy_constants[node.id]
+        if node.id in parameters:
+            return parameters[node.id]
+        raise ValueError(f"Unknown name '{node.id}'")
+    if isinstance(node, ast.BinOp) and type(node.op) in _binary_operators:
+        return _binary_operators[type(node.op)](_to_sympy(node.left, parameters), _to_sympy(node.right, parameters))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        operand = _to_sympy(node.operand, parameters)
+        return -operand if isinstance(node.op, ast.USub) else operand
+    if isinstance(node, ast.Call):
+        return _call(node, parameters)
+    raise ValueError(f"Unsupported syntax in equation: {ast.unparse(node)}")
+
+def _depth(tree):
+    """
+    Depth of a syntax tree, computed without recursion.
+    """
+    deepest, stack = 0, [(tree, 1)]
+    while stack:
+        node, depth = stack.pop()
+        deepest = max(deepest, depth)
+        stack.extend((child, depth + 1) for child in ast.iter_child_nodes(node))
+    return deepest
+
+def parameter_symbols(parameters):
+    """
+    Symbols for the named parameters of an equation, such as ('a', 'b').
+    Raises ValueError for names that are not identifiers or that clash with
+    t, the states, the constants or the allowed functions.
+    """
+    for name in parameters:
+        if (not name.isidentifier() or name in ('t', 'y') or re.fullmatch(r'y\d+', name)
+                or name in sympy_constants or name in sympy_functions or name in ('where', 'piecewise')):
+            raise ValueError(f"'{name}' cannot be used as a parameter name")
+    if len(set(parameters)) != len(parameters):
+        raise ValueError("Parameter names must be unique")
+    return tuple(sp.Symbol(name, real=True) for name in parameters)
+
+def parse_equation(equation_str, parameters=()):
+    """
+    Parse one right-hand side into a SymPy expression without evaluating any code.
+    Names listed in parameters are accepted as parameter symbols.
+    Raises ValueError for syntax errors and for anything outside the whitelist.
+    """
+    if len(equation_str) > MAX_EQUATION_LENGTH:
+        raise ValueError(f"Equations are limited to {MAX_EQUATION_LENGTH} characters")
+    try:
+        # y^2 means y**2, as in SymPy, with the precedence of a power
+        tree = ast.parse(equation_str.strip().replace('^', '**'), mode='eval')
+    except (SyntaxError, RecursionError, MemoryError):
+        raise ValueError(f"Invalid equation syntax: {equation_str}")
+    if _depth(tree.body) > MAX_EQUATION_DEPTH:
+        raise ValueError(f"Equations are limited to {MAX_EQUATION_DEPTH} levels of nesting")
+    try:
+        return _to_sympy(tree.body, dict(zip(parameters, parameter_symbols(parameters))))
+    except RecursionError:
+        raise ValueError("Equation is nested too deeply")
+
+@lru_cache(maxsize=128)
+def compile_expression(expr):
+    """
+    Compile a SymPy expression f(t, y) into a vectorized NumPy function.
+    SymPy expressions are hashable, so equivalent inputs share one compiled function.
+    """
+    func = sp.lambdify((t_symbol, y_symbol), expr, modules='numpy')
+    if y_symbol in expr.free_symbols:
+        return func
+    # Broadcast expressions that do not depend on y to the shape of the state
+    return lambda t, y: func(t, y) + np.zeros_like(y, dtype=float)
+
+def split_system(equation_str):
+    """
+    Split a system of ODEs written as 'f0; f1; ...' into its component strings.
+    """
+    return [part.strip() for part in equation_str.split(';') if part.strip()]
+
+def state_symbols(n):
+    """
+    Symbols y0, ..., y{n-1} used for the components of a system.
+    """
+    return sp.symbols(f'y0:{n}', real=True)
+
+def parse_system(equation_str, parameters=()):
+    """
+    Parse every component of a system into a tuple of SymPy expressions.
+    Raises ValueError when the string is empty or refers to a component the
+    system does not have.
+    """
+    exprs = tuple(parse_equation(part, parameters) for part in split_system(equation_str))
+    if not exprs:
+        raise ValueError("Enter at least one equation")
+    allowed = set(state_symbols(len(exprs))) | {t_symbol} | set(parameter_symbols(parameters))
+    if len(exprs) == 1:
+        allowed.add(y_symbol)
+    for expr in exprs:
+        unknown = expr.free_symbols - allowed
+        if unknown:
+            raise ValueError(f"Unknown state {', '.join(sorted(map(str, unknown)))} for a {len(exprs)}-component equation")
+    return exprs
+
+@lru_cache(maxsize=128)
+def compile_system(exprs):
+    """
+    Compile the right-hand sides of a system into a vectorized NumPy function.
+
+    The state y carries the components on its last axis, so y can be a single
+    state of shape (n,) or a whole ensemble of shape (..., n). The returned
+    derivative has the same shape as y. A time argument with as many dimensions
+    as y is assumed to carry a trailing singleton component axis.
+    """
+    return _compile_components(exprs, len(exprs))
+
+def _compile_components(exprs, n):
+    """
+    Compile expressions over t and y0, ..., y{n-1} into a function of (t, y)
+    that stacks their values on a new last axis (see compile_system).
+    """
+    func = sp.lambdify((t_symbol,) + state_symbols(n), list(exprs), modules='numpy')
+
+    def system(t, y):
+        y = np.asarray(y)
+        t = np.asarray(t)
+        if t.ndim and t.ndim == y.ndim:
+            t = t[..., 0]
+        components = [y[..., i] for i in range(n)]
+        values = func(t, *components)
+        # Constant components come back as scalars, so broadcast before stacking
+        return np.stack(np.broadcast_arrays(*values, components[0])[:-1], axis=-1)
+
+    return system
+
+@lru_cache(maxsize=128)
+def compile_equation(equation_str):
+    """
+    Parse an ODE string once and return the compiled callable f(t, y).
+    Works with both scalar and array arguments. Strings with several
+    ';'-separated components compile to a system over y0, y1, ...
+    """
+    exprs = parse_system(equation_str)
+    if len(exprs) > 1:
+        return compile_system(exprs)
+    # A single equation may also refer to its state as y0
+    return compile_expression(exprs[0].subs(state_symbols(1)[0], y_symbol))
+
+@lru_cache(maxsize=128)
+def compile_hamiltonian_split(equation_str):
+    """
+    Compile a system written as positions followed by momenta into separate
+    velocity(t, y) and force(t, y) functions, which evaluate only the first
+    and only the second half of the components, for the symplectic methods.
+    """
+    exprs = parse_system(equation_str)
+    n = len(exprs)
+    if n % 2:
+        raise ValueError("Symplectic methods need a system with an even number of components")
+    return _compile_components(exprs[:n // 2], n), _compile_components(exprs[n // 2:], n)
+
+@lru_cache(maxsize=128)
+def compile_quantity(quantity_str, n):
+    """
+    Compile a scalar function of the state, such as the energy of a
+    Hamiltonian system, written in the same syntax as the equations.
+    It evaluates to shape y.shape for a single equation (n = 1) and to
+    y.shape[:-1] for an n-component system.
+    """
+    expr = parse_equation(quantity_str)
+    allowed = set(state_symbols(n)) | {t_symbol}
+    if n == 1:
+        expr = expr.subs(state_symbols(1)[0], y_symbol)
+        allowed.add(y_symbol)
+    unknown = expr.free_symbols - allowed
+    if unknown:
+        raise ValueError(f"Unknown state {', '.join(sorted(map(str, unknown)))} for a {n}-component equation")
+    if n == 1:
+        return compile_expression(expr)
+    func = _compile_components([expr], n)
+    return lambda t, y: func(t, y)[..., 0]
+
+@lru_cache(maxsize=128)
+def compile_jacobian(equation_str):
+    """
+    Derive df/dy symbolically and compile it for the implicit methods.
+    For a single equation J(t, y) has the shape of y; for an n-component
+    system it is the matrix of partials with shape y.shape + (n,), where
+    J[..., i, j] is the derivative of component i with respect to y_j.
+    """
+    exprs = parse_system(equation_str)
+    if len(exprs) == 1:
+        expr = exprs[0].subs(state_symbols(1)[0], y_symbol)
+        return compile_expression(sp.diff(expr, y_symbol))
+
+    n = len(exprs)
+    entries = _compile_components(
+        [sp.diff(expr, symbol) for expr in exprs for symbol in state_symbols(n)], n
+    )
+
+    def jacobian(t, y):
+        values = entries(t, y)
+        return values.reshape(values.shape[:-1] + (n, n))
+
+    return jacobian
+
+def _sensitivity_equations(exprs, states, params):
+    """
+    Append the forward sensitivity equations dS/dt = df/dy S + df/dp, where
+    S[i, j] = dy_i/dp_j, to a system. The sensitivities follow the states,
+    row by row, as extra components.
+    """
+    F = sp.Matrix(exprs)
+    S = sp.Matrix(len(states), len(params), [sp.Dummy(f's{i}') for i in range(len(states) * len(params))])
+    dS = F.jacobian(states) * S + F.jacobian(params)
+    return tuple(exprs) + tuple(dS), tuple(states) + tuple(S)
+
+@lru_cache(maxsize=128)
+def compile_parametric(equation_str, parameters, sensitivities=False):
+    """
+    Compile an ODE with named parameters, e.g. 'a*sin(t) - b*y**2' with
+    parameters ('a', 'b'), into a vectorized function f(t, y, p).
+
+    p holds the parameter values on its last axis, in the order of parameters,
+    and broadcasts against the state without its component axis: a batch of
+    m states of shape (m,) or (m, n) with p of shape (m, k) integrates every
+    state with its own parameters.
+
+    With sensitivities, the state is augmented with dy/dp, derived
+    symbolically: components n, ..., n + n*k - 1 hold S[i, j] = dy_i/dp_j row
+    by row, and the augmented state always carries a component axis.
+    """
+    exprs = parse_system(equation_str, parameters)
+    if len(exprs) == 1:
+        exprs, states = (exprs[0].subs(state_symbols(1)[0], y_symbol),), (y_symbol,)
+    else:
+        states = state_symbols(len(exprs))
+    params = parameter_symbols(parameters)
+    if sensitivities:
+        exprs, states = _sensitivity_equations(exprs, states, params)
+    func = sp.lambdify((t_symbol,) + tuple(states) + params, list(exprs), modules='numpy')
+    n = len(states)
+
+    def system(t, y, p):
+        y = np.asarray(y)
+        t = np.asarray(t)
+        p = np.asarray(p, dtype=float)
+        if n == 1:
+            components = [y]
+        else:
+            if t.ndim and t.ndim == y.ndim:
+                t = t[..., 0]
+            components = [y[..., i] for i in range(n)]
+        values = func(t, *components, *[p[..., j] for j in range(len(params))])
+        # Constant components come back as scalars, and p may widen the batch
+        shape = np.broadcast_shapes(components[0].shape, p.shape[:-1], *[np.shape(value) for value in values])
+        values = [np.broadcast_to(value, shape).astype(float) for value in values]
+        return values[0] if n == 1 else np.stack(values, axis=-1)
+
+    return system
+
+@lru_cache(maxsize=128)
+def compile_jit_equation(equation_str):
+    """
+    Compile a scalar ODE string into a Numba nopython function f(t, y) for the
+    compiled stepping loops in methods.py.
+    Returns None when Numba is not installed, the string is a system, or the
+    expression uses something Numba cannot compile.
+    """
+    try:
+        # Imported here so that importing this module does not load Numba
+        import numba
+    except ImportError:
+        return None
+    exprs = parse_system(equation_str)
+    if len(exprs) > 1:
+        return None
+    expr = exprs[0].subs(state_symbols(1)[0], y_symbol)
+    try:
+        # Eager compilation with an explicit signature surfaces failures here
+        return numba.njit('float64(float64, float64)')(sp.lambdify((t_symbol, y_symbol), expr, modules='math'))
+    except Exception:
+        return None
@@ -0,0 +1,128 @@
+# export.py
+
+"""
+Full-resolution export of trajectories for analysis outside the app.
+
+Every trajectory (t, x, reference and percent error at each step, for each
+method and step size) goes into one table, written in a single bulk write
+as an Arrow IPC file or as Parquet. Rows are laid out trajectory after
+trajectory, and the schema metadata carries an index of where each one
+starts, along with the equation and initial conditions.
+
+Arrow IPC files are read back memory-mapped, so the columns are views of the
+file and nothing is copied until it is used:
+
+    table = read_trajectories('trajectories.arrow')
+    for entry in trajectory_index(table):
+        arrays = trajectory_arrays(table, entry['method'], entry['step_size'])
+
+pyarrow is only needed when exporting or reading.
+"""
+
+import json
+import numpy as np
+from utils import percent_error
+
+def _columns(x_values, x_real):
+    """
+    Per-component columns of a trajectory: x, x_real and error for a single
+    equation, x0, x_real0, error0, x1, ... for a system.
+    """
+    errors = percent_error(x_real, x_values)
+    if x_values.ndim == 1:
+        return {'x': x_values, 'x_real': x_real, 'error': errors}
+    columns = {}
+    for i in range(x_values.shape[1]):
+        columns.update({f'x{i}': x_values[:, i], f'x_real{i}': x_real[:, i], f'error{i}': errors[:, i]})
+    return columns
+
+def export_trajectories(sink, trajectories, file_format='arrow', metadata=None):
+    """
+    Write trajectories, an iterable of (method, h, t_values, x_values, x_real)
+    as returned per method by pipeline.get_trajectories, to sink (a path or a
+    binary file object) in one write.
+
+    file_format is 'arrow' (Arrow IPC, can be memory-mapped) or 'parquet'
+    (compressed, decoded on read). metadata, e.g. the equation and x0, is
+    stored as JSON in the schema metadata.
+    """
+    import pyarrow as pa
+
+    trajectories = list(trajectories)
+    # IPC files allow one dictionary per column, so every batch shares the list of methods
+    methods = pa.array(list(dict.fromkeys(method for method, *_ in trajectories)))
+    codes = {method: code for code, method in enumerate(methods.to_pylist())}
+    batches, index, start = [], [], 0
+    for method, h, t_values, x_values, x_real in trajectories:
+        x_values, x_real = np.asarray(x_values), np.asarray(x_real)
+        n = len(t_values)
+        arrays = {
+            'method': pa.DictionaryArray.from_arrays(np.full(n, codes[method], dtype=np.int32), methods),
+            'step_size': np.full(n, float(h)),
+            'step': np.arange(n),
+            't': np.asarray(t_values, dtype=float),
+            **_columns(x_values, x_real),
+        }
+        batches.append(pa.RecordBatch.from_pydict(arrays))
+        index.append({'method': method, 'step_size': float(h), 'start': start, 'length': n})
+        start += n
+    if not batches:
+        raise ValueError("There are no trajectories to export")
+    if len({batch.schema for batch in batches}) > 1:
+        raise ValueError("Every exported trajectory must have the same number of components")
+
+    table = pa.Table.from_batches(batches).replace_schema_metadata({
+        'trajectories': json.dumps(index),
+        'ode': json.dumps(metadata or {}),
+    })
+
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table, sink)
+    elif file_format == 'arrow':
+        # Uncompressed, so that readers can map the columns straight from the file
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        raise ValueError(f"Unknown export format '{file_format}'")
+
+def read_trajectories(path):
+    """
+    Open an export as a pyarrow Table. Arrow IPC files are memory-mapped, so
+    the table does not copy the data; Parquet files are decoded into memory.
+    """
+    import pyarrow as pa
+
+    with open(path, 'rb') as file:
+        is_parquet = file.read(4) == b'PAR1'
+    if is_parquet:
+        import pyarrow.parquet as pq
+        return pq.read_table(path, memory_map=True)
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+def trajectory_index(table):
+    """
+    The exported trajectories as dicts with method, step_size, start and length.
+    """
+    return json.loads(table.schema.metadata[b'trajectories'])
+
+def export_metadata(table):
+    """
+    The metadata given to export_trajectories, such as the equation and x0.
+    """
+    return json.loads(table.schema.metadata[b'ode'])
+
+def trajectory_arrays(table, method, step_size):
+    """
+    NumPy arrays of one trajectory by column name (t, x, x_real, error or
+    their per-component variants). For a memory-mapped Arrow IPC file every
+    trajectory is a single record batch, and the arrays are views of the file.
+    """
+    for entry in trajectory_index(table):
+        if entry['method'] == method and entry['step_size'] == step_size:
+            rows = table.slice(entry['start'], entry['length'])
+            return {
+                name: rows.column(name).chunk(0).to_numpy() if rows.column(name).num_chunks == 1 else rows.column(name).to_numpy()
+                for name in rows.column_names if name not in ('method', 'step_size')
+            }
+    raise KeyError(f"No trajectory for {method} with step size {step_size}")
@@ -0,0 +1,89 @@
+# instrumentation.py
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+class Metrics:
+    """
+    Accumulated wall time per stage and event counters for one request.
+    """
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+
+    def add_time(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def increment(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def as_dict(self):
+        return {
+            'timings': {stage: round(seconds, 6) for stage, seconds in self.timings.items()},
+            'counters': dict(self.counters),
+        }
+
+# Metrics of the request running in the current thread or task, if any
+_current_metrics = ContextVar('current_metrics', default=None)
+
+@contextmanager
+def collect_metrics():
+    """
+    Collect every timing and counter recorded inside the block into a new Metrics.
+    """
+    metrics = Metrics()
+    token = _current_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+@contextmanager
+def timed(stage):
+    """
+    Add the wall time of the block to stage in the active metrics.
+    Does nothing beyond reading the clock when no metrics are being collected.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = _current_metrics.get()
+        if metrics is not None:
+            metrics.add_time(stage, time.perf_counter() - start)
+
+def count(name, amount=1):
+    """
+    Increment a counter in the active metrics.
+    """
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.increment(name, amount)
+
+class CountingFunction:
+    """
+    Wrap a right-hand side f(t, y) and count how many times it is evaluated.
+    With batched, each call counts once per entry of y's first axis, e.g. once
+    per step size in methods.batch_method.
+    """
+    def __init__(self, f, batched=False):
+        self.f = f
+        self.batched = batched
+        self.calls = 0
+
+    def __call__(self, t, y):
+        self.calls += len(y) if self.batched else 1
+        return self.f(t, y)
+
+def counted_options(options, batched=False):
+    """
+    Wrap the velocity and force halves of a symplectic method in options, if
+    any (see pipeline.method_options), in CountingFunctions. Returns the new
+    options and a function giving the right-hand side evaluations so far, each
+    half counting as half an evaluation.
+    """
+    if 'split' not in options:
+        return options, lambda: 0
+    halves = tuple(CountingFunction(half, batched) for half in options['split'])
+    return {**options, 'split': halves}, lambda: sum(half.calls for half in halves) / 2
@@ -0,0 +1,172 @@
+# jobs.py
+
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from equations import compile_jit_equation
+from solvers import dynamic_ode_function
+from methods import embedded_pairs, implicit_methods, time_grid
+from pipeline import get_reference_curve, get_trajectories, method_options, trajectory_key
+from streaming import stream_trajectory
+from cache import cache_key, load_arrays, save_arrays
+
+# Points kept in the partial trajectory reported after each chunk
+PARTIAL_POINTS = 2000
+
+# Finished jobs whose outcome is kept for later reruns of the page
+MAX_FINISHED_JOBS = 100
+
+class JobCancelled(Exception):
+    pass
+
+def job_key(request):
+    """
+    Job ID of a request: identical requests from any session share one job.
+    """
+    return cache_key('job', sorted(
+        (name, sorted(value.items()) if isinstance(value, dict) else value) for name, value in request.items()
+    ))
+
+def _report(progress, job_id, fraction, label, t_values=None, x_values=None):
+    partial = None
+    if t_values is not None:
+        stride = max(1, len(t_values) // PARTIAL_POINTS)
+        partial = (t_values[::stride], x_values[::stride])
+    progress[job_id] = {'fraction': fraction, 'label': label, 'partial': partial}
+
+def run_job(job_id, request, progress, cancelled):
+    """
+    Worker side of a job: integrate every trajectory of the request into the
+    disk cache, then solve the reference, so that the app renders the result
+    from cache hits only.
+
+    Fixed-step trajectories are integrated in chunks (see streaming.py). After
+    each chunk the job reports its progress and a decimated partial trajectory,
+    and checks whether it was cancelled. A cancelled job keeps the steps done so
+    far in the cache, and a later run resumes from there.
+    """
+    equation_str, x0, t0, tf = request['equation_str'], request['x0'], request['t0'], request['tf']
+    method, step_sizes = request['method'], request['step_sizes']
+    x0_array = np.asarray(x0, dtype=float)
+
+    if method in embedded_pairs:
+        _report(progress, job_id, 0.0, method)
+        get_trajectories(equation_str, x0, t0, tf, method, step_sizes, request['rtol'], request['atol'], request['use_jit'], request['reference'])
+    else:
+        ode_func = dynamic_ode_function(equation_str)
+        step_f = compile_jit_equation(equation_str) if request['use_jit'] and method not in implicit_methods else None
+        step_options = method_options(equation_str, method)
+        grids = {h: time_grid(t0, tf, h) for h in step_sizes}
+        total = sum(len(grid) - 1 for grid in grids.values())
+        done = 0
+
+        for h in step_sizes:
+            grid = grids[h]
+            key = trajectory_key(equation_str, x0, t0, method, h)
+            cached = load_arrays(key)
+            x_values = cached['x'] if cached is not None else x0_array[None]
+            start = len(x_values) - 1
+            done += min(start, len(grid) - 1)
+            if start >= len(grid) - 1:
+                continue
+
+            chunk_size = max(1000, (len(grid) - 1 - start) // 50)
+            parts = [x_values]
+            chunks = stream_trajectory(ode_func, grid[start], grid[-1], x_values[-1], h, method, chunk_size, reference=False, step_f=step_f, method_options=step_options)
+            for i, (t_chunk, x_chunk, _, _) in enumerate(chunks):
+                # The first chunk starts with the state that is already stored
+                parts.append(x_chunk[1:] if i == 0 else x_chunk)
+                done += len(x_chunk) - (i == 0)
+                if cancelled.get(job_id):
+                    save_arrays(key, x=np.concatenate(parts))
+                    raise JobCancelled(f"{method} (h={h}) was cancelled")
+                x_so_far = np.concatenate(parts)
+                _report(progress, job_id, done / total, f'{method} (h={h})', grid[:len(x_so_far)], x_so_far)
+            save_arrays(key, x=np.concatenate(parts))
+
+    _report(progress, job_id, 1.0, 'reference solution')
+    get_reference_curve(equation_str, x0, t0, tf, step_sizes if method not in embedded_pairs else (), request['reference'])
+
+class JobQueue:
+    """
+    Background solves in a process pool.
+
+    Jobs are identified by job_key, so submitting a request that is already
+    queued, running or finished returns the existing job instead of starting
+    another one. The MAX_FINISHED_JOBS most recently submitted finished jobs
+    are kept, so that reruns of the page find their outcome; older ones are
+    forgotten and run again (from the disk cache) when requested. Progress and
+    cancellation flags live in a multiprocessing manager, where the workers
+    can reach them.
+    """
+    def __init__(self, max_workers=None):
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+        self.manager = multiprocessing.Manager()
+        self.progress = self.manager.dict()
+        self.cancelled = self.manager.dict()
+        self.futures = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, request, restart=False):
+        """
+        Queue request unless an identical job exists and return its job ID.
+        With restart, a finished, failed or cancelled job is run again.
+        """
+        job_id = job_key(request)
+        with self.lock:
+            future = self.futures.get(job_id)
+            if future is None or (restart and future.done()):
+                self.cancelled[job_id] = False
+                self.progress[job_id] = {'fraction': 0.0, 'label': 'queued', 'partial': None}
+                self.futures[job_id] = self.executor.submit(run_job, job_id, request, self.progress, self.cancelled)
+            # Jobs are ordered by their last submission, so the least recently requested are forgotten first
+            self.futures.move_to_end(job_id)
+            finished = [key for key, future in self.futures.items() if future.done()]
+            for key in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                del self.futures[key]
+                self.progress.pop(key, None)
+                self.cancelled.pop(key, None)
+        return job_id
+
+    def _future(self, job_id):
+        with self.lock:
+            return self.futures.get(job_id)
+
+    def state(self, job_id):
+        """
+        One of 'pending', 'running', 'done', 'failed' or 'cancelled'. A job
+        that was forgotten in the meantime, e.g. after submissions from other
+        sessions, counts as pending, so that polling submits it again.
+        """
+        future = self._future(job_id)
+        if future is None:
+            return 'pending'
+        if future.cancelled():
+            return 'cancelled'
+        if not future.done():
+            return 'running' if future.running() else 'pending'
+        error = future.exception()
+        if isinstance(error, JobCancelled):
+            return 'cancelled'
+        return 'failed' if error is not None else 'done'
+
+    def status(self, job_id):
+        """
+        Latest progress report: fraction done, a label and the partial trajectory (t, x) or None.
+        """
+        return self.progress.get(job_id, {'fraction': 0.0, 'label': '', 'partial': None})
+
+    def error(self, job_id):
+        future = self._future(job_id)
+        return future.exception() if future is not None and future.done() else None
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued job right away; a running one stops after its current chunk.
+        """
+        future = self._future(job_id)
+        if future is not None:
+            self.cancelled[job_id] = True
+            future.cancel()
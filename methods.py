@@ -1,31 +1,570 @@
+import importlib.util
+import sys
 import numpy as np
+from functools import partial, lru_cache
 
+# Numba is an optional compiled backend, imported by the first compiled loop rather than at startup
+numba_available = importlib.util.find_spec('numba') is not None
+
+# Explicit Runge-Kutta methods as Butcher tableaus: stage i is evaluated at
+# t + c[i] * h on x + h * sum(A[i][j] * k[j]), and the step is x + h * sum(b[i] * k[i])
+explicit_tableaus = {
+    'Euler': {
+        'order': 1,
+        'c': [0],
+        'A': [[]],
+        'b': [1],
+    },
+    'Runge-Kutta 2nd Order': {  # Explicit midpoint rule
+        'order': 2,
+        'c': [0, 1/2],
+        'A': [[], [1/2]],
+        'b': [0, 1],
+    },
+    'Heun': {
+        'order': 2,
+        'c': [0, 1],
+        'A': [[], [1]],
+        'b': [1/2, 1/2],
+    },
+    'Ralston': {
+        'order': 2,
+        'c': [0, 2/3],
+        'A': [[], [2/3]],
+        'b': [1/4, 3/4],
+    },
+    'Runge-Kutta 3rd Order': {  # Kutta's third-order method
+        'order': 3,
+        'c': [0, 1/2, 1],
+        'A': [[], [1/2], [-1, 2]],
+        'b': [1/6, 2/3, 1/6],
+    },
+    'Runge-Kutta 4th Order': {
+        'order': 4,
+        'c': [0, 1/2, 1/2, 1],
+        'A': [[], [1/2], [0, 1/2], [0, 0, 1]],
+        'b': [1/6, 1/3, 1/3, 1/6],
+    },
+    'Runge-Kutta 3/8 Rule': {
+        'order': 4,
+        'c': [0, 1/3, 2/3, 1],
+        'A': [[], [1/3], [-1/3, 1], [1, -1, 1]],
+        'b': [1/8, 3/8, 3/8, 1/8],
+    },
+    'Butcher 5th Order': {
+        'order': 5,
+        'c': [0, 1/4, 1/4, 1/2, 3/4, 1],
+        'A': [
+            [],
+            [1/4],
+            [1/8, 1/8],
+            [0, -1/2, 1],
+            [3/16, 0, 0, 9/16],
+            [-3/7, 2/7, 12/7, -12/7, 8/7],
+        ],
+        'b': [7/90, 0, 32/90, 12/90, 32/90, 7/90],
+    },
+    'Butcher 6th Order': {
+        'order': 6,
+        'c': [0, 1/3, 2/3, 1/3, 1/2, 1/2, 1],
+        'A': [
+            [],
+            [1/3],
+            [0, 2/3],
+            [1/12, 1/3, -1/12],
+            [-1/16, 9/8, -3/16, -3/8],
+            [0, 9/8, -3/8, -3/4, 1/2],
+            [9/44, -9/11, 63/44, 18/11, 0, -16/11],
+        ],
+        'b': [11/120, 0, 27/40, 27/40, -4/15, -4/15, 11/120],
+    },
+}
+
+def _tableau_arrays(tableau):
+    """
+    c, A and b of a tableau as float arrays, with A padded to a square matrix.
+    """
+    stages = len(tableau['c'])
+    A = np.zeros((stages, stages))
+    for i, row in enumerate(tableau['A']):
+        A[i, :len(row)] = row
+    return np.array(tableau['c'], dtype=float), A, np.array(tableau['b'], dtype=float)
+
+def _tableau_loop(f, t_values, x, h, c, A, b, k):
+    # Stage derivatives go into the preallocated buffer k; zero coefficients are skipped
+    stages = len(c)
+    x_n = x[0]
+    for n in range(len(t_values) - 1):
+        t_n = t_values[n]
+        for i in range(stages):
+            x_stage = x_n
+            for j in range(i):
+                if A[i][j] != 0:
+                    x_stage = x_stage + h * A[i][j] * k[j]
+            k[i] = f(t_n + c[i] * h, x_stage)
+        for i in range(stages):
+            if b[i] != 0:
+                x_n = x_n + h * b[i] * k[i]
+        x[n+1] = x_n
+
+def _python_tableau_loop(f, t_values, x, h, tableau):
+    # Interpreted loop: only the nonzero coefficients, premultiplied by h, are visited
+    stages = [(c_i * h, [(j, h * a) for j, a in enumerate(row) if a != 0]) for c_i, row in zip(tableau['c'], tableau['A'])]
+    weights = [(i, h * b_i) for i, b_i in enumerate(tableau['b']) if b_i != 0]
+    x_n = x[0]
+    if len(stages) == 1:
+        # One-stage tableaus (Euler) need no stage buffer
+        (dt, _), ((_, hb),) = stages[0], weights
+        for n, t_n in enumerate(t_values[:-1]):
+            x_n = x_n + hb * f(t_n + dt, x_n)
+            x[n+1] = x_n
+        return
+    k = [None] * len(stages)
+    for n, t_n in enumerate(t_values[:-1]):
+        for i, (dt, row) in enumerate(stages):
+            x_stage = x_n
+            for j, ha in row:
+                x_stage = x_stage + ha * k[j]
+            k[i] = f(t_n + dt, x_stage)
+        for i, hb in weights:
+            x_n = x_n + hb * k[i]
+        x[n+1] = x_n
+
+@lru_cache(maxsize=None)
+def _jit_tableau_loop():
+    """
+    Compiled version of the stepping loop, used when f itself is a Numba function.
+    """
+    import numba
+    return numba.njit(_tableau_loop)
+
+def rk_method(f, t_values, x0, h, tableau):
+    """
+    Integrate over the whole grid with the explicit Runge-Kutta method of a tableau.
+
+    The loop is compiled when f is a Numba function (see
+    equations.compile_jit_equation) and the state is scalar; anything else runs
+    an interpreted loop over plain lists, which index faster than arrays.
+    """
+    x = np.zeros((len(t_values),) + np.shape(x0))
+    x[0] = x0
+    # A Numba function can only exist once something has imported Numba
+    numba = sys.modules.get('numba')
+    if numba is not None and isinstance(f, numba.core.dispatcher.Dispatcher) and x.ndim == 1:
+        c, A, b = _tableau_arrays(tableau)
+        k = np.zeros(len(c))
+        _jit_tableau_loop()(f, np.asarray(t_values, dtype=float), x, float(h), c, A, b, k)
+    else:
+        _python_tableau_loop(f, np.asarray(t_values).tolist(), x, h, tableau)
+    return x
+
+def rk_step(f, t, x, h, tableau):
+    """
+    One step of the explicit Runge-Kutta method of a tableau; h may be an array
+    that broadcasts against a batch of states (see batch_method).
+    """
+    k = []
+    for c_i, row in zip(tableau['c'], tableau['A']):
+        x_stage = x
+        for a, k_j in zip(row, k):
+            if a != 0:
+                x_stage = x_stage + h * a * k_j
+        k.append(f(t + c_i * h, x_stage))
+    x_next = x
+    for b_i, k_i in zip(tableau['b'], k):
+        if b_i != 0:
+            x_next = x_next + h * b_i * k_i
+    return x_next
+
+# The classic methods by their own names, for callers that predate the tableau registry
 def euler_method(f, t_values, x0, h):
-    N = len(t_values)
-    x_euler = np.zeros(N)
-    x_euler[0] = x0
-    for n in range(N - 1):
-        x_euler[n+1] = x_euler[n] + h * f(t_values[n], x_euler[n])
-    return x_euler
+    return rk_method(f, t_values, x0, h, explicit_tableaus['Euler'])
 
 def rk2_method(f, t_values, x0, h):
-    N = len(t_values)
-    x_rk2 = np.zeros(N)
-    x_rk2[0] = x0
-    for n in range(N - 1):
-        k1 = h * f(t_values[n], x_rk2[n])
-        k2 = h * f(t_values[n] + h/2, x_rk2[n] + k1/2)
-        x_rk2[n+1] = x_rk2[n] + k2
-    return x_rk2
+    return rk_method(f, t_values, x0, h, explicit_tableaus['Runge-Kutta 2nd Order'])
 
 def rk4_method(f, t_values, x0, h):
-    N = len(t_values)
-    x_rk4 = np.zeros(N)
-    x_rk4[0] = x0
-    for n in range(N - 1):
-        k1 = h * f(t_values[n], x_rk4[n])
-        k2 = h * f(t_values[n] + h/2, x_rk4[n] + k1/2)
-        k3 = h * f(t_values[n] + h/2, x_rk4[n] + k2/2)
-        k4 = h * f(t_values[n] + h, x_rk4[n] + k3)
-        x_rk4[n+1] = x_rk4[n] + (k1 + 2*k2 + 2*k3 + k4) / 6
-    return x_rk4
+    return rk_method(f, t_values, x0, h, explicit_tableaus['Runge-Kutta 4th Order'])
+
+def euler_step(f, t, x, h):
+    return rk_step(f, t, x, h, explicit_tableaus['Euler'])
+
+def rk2_step(f, t, x, h):
+    return rk_step(f, t, x, h, explicit_tableaus['Runge-Kutta 2nd Order'])
+
+def rk4_step(f, t, x, h):
+    return rk_step(f, t, x, h, explicit_tableaus['Runge-Kutta 4th Order'])
+
+def _run_loop(loop, f, t_values, x0, h):
+    """
+    Preallocate the result and run a stepping loop over it.
+    """
+    x = np.zeros((len(t_values),) + np.shape(x0))
+    x[0] = x0
+    loop(f, t_values, x, h)
+    return x
+
+def _momentum_index(x):
+    """
+    Index where the momenta start in a state of positions followed by momenta.
+    """
+    n = np.shape(x)[-1] if np.ndim(x) else 0
+    if n == 0 or n % 2:
+        raise ValueError("Symplectic methods need a system with an even number of components: "
+                         "positions y0, ..., y{m-1} followed by momenta y{m}, ..., y{2m-1}")
+    return n // 2
+
+def _split_functions(f, m, split):
+    """
+    The velocity and force halves of the derivative, as functions of (t, x)
+    that return the first m and the last m components. split, e.g. from
+    equations.compile_hamiltonian_split, evaluates each half on its own;
+    without it both halves slice a full evaluation of f.
+    """
+    if split is not None:
+        return split
+    return (lambda t, x: f(t, x)[..., :m]), (lambda t, x: f(t, x)[..., m:])
+
+def _verlet_substep(velocity, force, t, q, p, a, h):
+    """
+    Kick, drift, kick (velocity Verlet / leapfrog) from positions q and
+    momenta p, where a is the force at (t, q). Returns the new positions,
+    momenta and force; the force closing this step opens the next one, which
+    holds for separable Hamiltonians, whose forces depend on the positions only.
+    """
+    p_half = p + h/2 * a
+    q_new = q + h * velocity(t + h/2, np.concatenate([q, p_half], axis=-1))
+    a_new = force(t + h, np.concatenate([q_new, p_half], axis=-1))
+    return q_new, p_half + h/2 * a_new, a_new
+
+def symplectic_euler_step(f, t, x, h, split=None):
+    m = _momentum_index(x)
+    velocity, force = _split_functions(f, m, split)
+    q, p = x[..., :m], x[..., m:]
+    p_new = p + h * force(t, x)
+    q_new = q + h * velocity(t, np.concatenate([q, p_new], axis=-1))
+    return np.concatenate([q_new, p_new], axis=-1)
+
+def verlet_step(f, t, x, h, split=None):
+    m = _momentum_index(x)
+    velocity, force = _split_functions(f, m, split)
+    q_new, p_new, _ = _verlet_substep(velocity, force, t, x[..., :m], x[..., m:], force(t, x), h)
+    return np.concatenate([q_new, p_new], axis=-1)
+
+# Yoshida's triple jump: three Verlet steps of these fractions of h give order 4
+_yoshida_weights = (
+    1 / (2 - 2 ** (1/3)),
+    -2 ** (1/3) / (2 - 2 ** (1/3)),
+    1 / (2 - 2 ** (1/3)),
+)
+
+def yoshida4_step(f, t, x, h, split=None):
+    m = _momentum_index(x)
+    velocity, force = _split_functions(f, m, split)
+    q, p, a = x[..., :m], x[..., m:], force(t, x)
+    for weight in _yoshida_weights:
+        q, p, a = _verlet_substep(velocity, force, t, q, p, a, weight * h)
+        t = t + weight * h
+    return np.concatenate([q, p], axis=-1)
+
+def _symplectic_euler_loop(f, t_values, x, h, split=None):
+    for n in range(len(t_values) - 1):
+        x[n+1] = symplectic_euler_step(f, t_values[n], x[n], h, split)
+
+def _verlet_loop(f, t_values, x, h, weights=(1,), split=None):
+    """
+    Verlet substeps of weights * h per step. The force closing each substep
+    opens the next one, also across steps, so a step costs one force and one
+    velocity evaluation per substep.
+    """
+    m = _momentum_index(x[0])
+    velocity, force = _split_functions(f, m, split)
+    a = force(t_values[0], x[0])
+    for n in range(len(t_values) - 1):
+        t, q, p = t_values[n], x[n, :m], x[n, m:]
+        for weight in weights:
+            q, p, a = _verlet_substep(velocity, force, t, q, p, a, weight * h)
+            t = t + weight * h
+        x[n+1, :m], x[n+1, m:] = q, p
+
+def symplectic_euler_method(f, t_values, x0, h, split=None):
+    return _run_loop(partial(_symplectic_euler_loop, split=split), f, t_values, x0, h)
+
+def verlet_method(f, t_values, x0, h, split=None):
+    return _run_loop(partial(_verlet_loop, split=split), f, t_values, x0, h)
+
+def yoshida4_method(f, t_values, x0, h, split=None):
+    return _run_loop(partial(_verlet_loop, weights=_yoshida_weights, split=split), f, t_values, x0, h)
+
+def _newton_solve(f, jac, t, base, gh, tol=1e-10, max_iterations=20):
+    """
+    Solve z = base + gh * f(t, z) for z with Newton's method, starting from base.
+
+    jac(t, y) is df/dy: elementwise for scalar states and of shape
+    y.shape + (n,) for systems (see equations.compile_jacobian), so whole
+    batches of states are solved at once. A step size of zero returns base.
+    Raises RuntimeError when the iterations do not converge, which usually
+    means the step size is too large for the problem.
+    """
+    z = base
+    for _ in range(max_iterations):
+        residual = z - base - gh * f(t, z)
+        J = jac(t, z)
+        if np.ndim(J) == np.ndim(z):
+            dz = residual / (1 - gh * J)
+        else:
+            matrix = np.eye(J.shape[-1]) - np.asarray(gh)[..., None] * J
+            dz = np.linalg.solve(matrix, residual[..., None])[..., 0]
+        z = z - dz
+        if np.all(np.abs(dz) <= tol * (1 + np.abs(z))):
+            break
+    else:
+        # Slow final convergence is acceptable as long as the equation is nearly solved
+        residual = z - base - gh * f(t, z)
+        if not np.all(np.abs(residual) <= np.sqrt(tol) * (1 + np.abs(z))):
+            raise RuntimeError(f"Newton iterations did not converge at t={np.min(t):.6g} "
+                               f"after {max_iterations} iterations; try a smaller step size")
+    return z
+
+def finite_difference_jacobian(f, t, y, system=None):
+    """
+    Forward-difference df/dy for callers that have no symbolic Jacobian at hand,
+    in the layout of equations.compile_jacobian.
+
+    By default y is a single state, scalar or of shape (n,). For a batch of
+    states, system tells whether the last axis holds the components of a
+    system or the batch holds scalar states, which are differenced elementwise.
+    """
+    y = np.asarray(y, dtype=float)
+    if system is None:
+        system = y.ndim > 0
+    f0 = f(t, y)
+    if not system:
+        dy = 1e-7 * np.maximum(1.0, np.abs(y))
+        return (f(t, y + dy) - f0) / dy
+    columns = []
+    for j in range(y.shape[-1]):
+        dy = np.zeros_like(y)
+        dy[..., j] = 1e-7 * np.maximum(1.0, np.abs(y[..., j]))
+        columns.append((f(t, y + dy) - f0) / dy[..., j:j+1])
+    return np.stack(columns, axis=-1)
+
+def backward_euler_step(f, t, x, h, jac):
+    return _newton_solve(f, jac, t + h, x, h)
+
+def trapezoidal_step(f, t, x, h, jac):
+    return _newton_solve(f, jac, t + h, x + h/2 * f(t, x), h/2)
+
+# Two-stage, L-stable, stiffly accurate SDIRK of order 2 (Alexander, 1977)
+_sdirk_gamma = 1 - np.sqrt(2) / 2
+
+def sdirk2_step(f, t, x, h, jac):
+    g = _sdirk_gamma
+    z1 = _newton_solve(f, jac, t + g*h, x, g*h)
+    k1 = f(t + g*h, z1)
+    # The last stage equals the new state, since b is the last row of A
+    return _newton_solve(f, jac, t + h, x + (1 - g)*h * k1, g*h)
+
+def _implicit_method(step, f, t_values, x0, h, jac=None):
+    """
+    Run an implicit single-step rule over a whole grid. Without a symbolic
+    Jacobian the Newton iterations fall back to finite differences.
+    """
+    if jac is None:
+        jac = partial(finite_difference_jacobian, f)
+    x = np.zeros((len(t_values),) + np.shape(x0))
+    x[0] = x0
+    for n in range(len(t_values) - 1):
+        x[n+1] = step(f, t_values[n], x[n], h, jac)
+    return x
+
+def backward_euler_method(f, t_values, x0, h, jac=None):
+    return _implicit_method(backward_euler_step, f, t_values, x0, h, jac)
+
+def trapezoidal_method(f, t_values, x0, h, jac=None):
+    return _implicit_method(trapezoidal_step, f, t_values, x0, h, jac)
+
+def sdirk2_method(f, t_values, x0, h, jac=None):
+    return _implicit_method(sdirk2_step, f, t_values, x0, h, jac)
+
+# Implicit methods for stiff problems; their step functions take df/dy as jac
+implicit_methods = {'Backward Euler', 'Trapezoidal', 'SDIRK 2nd Order'}
+
+# Symplectic methods for Hamiltonian systems written as positions followed by
+# momenta; they take the velocity and force halves of the derivative as split
+symplectic_methods = {'Symplectic Euler', 'Stormer-Verlet', 'Yoshida 4th Order'}
+
+# Whole-trajectory fixed-step methods, keyed by the method names shown in the UI
+method_functions = {
+    **{name: partial(rk_method, tableau=tableau) for name, tableau in explicit_tableaus.items()},
+    'Backward Euler': backward_euler_method,
+    'Trapezoidal': trapezoidal_method,
+    'SDIRK 2nd Order': sdirk2_method,
+    'Symplectic Euler': symplectic_euler_method,
+    'Stormer-Verlet': verlet_method,
+    'Yoshida 4th Order': yoshida4_method,
+}
+
+# Global order of accuracy of each fixed-step method, used for Richardson extrapolation
+method_orders = {
+    **{name: tableau['order'] for name, tableau in explicit_tableaus.items()},
+    'Backward Euler': 1,
+    'Trapezoidal': 2,
+    'SDIRK 2nd Order': 2,
+    'Symplectic Euler': 1,
+    'Stormer-Verlet': 2,
+    'Yoshida 4th Order': 4,
+}
+
+# Right-hand side evaluations per step of each explicit fixed-step method; the
+# symplectic methods evaluate the velocity and the force half once per (sub)step
+method_stages = {
+    **{name: len(tableau['c']) for name, tableau in explicit_tableaus.items()},
+    'Symplectic Euler': 1,
+    'Stormer-Verlet': 1,
+    'Yoshida 4th Order': 3,
+}
+
+# Single-step update rules for the same methods
+step_functions = {
+    **{name: partial(rk_step, tableau=tableau) for name, tableau in explicit_tableaus.items()},
+    'Backward Euler': backward_euler_step,
+    'Trapezoidal': trapezoidal_step,
+    'SDIRK 2nd Order': sdirk2_step,
+    'Symplectic Euler': symplectic_euler_step,
+    'Stormer-Verlet': verlet_step,
+    'Yoshida 4th Order': yoshida4_step,
+}
+
+def time_grid(t0, tf, h):
+    """
+    Return the time points t0, t0 + h, ... that do not go past tf.
+    """
+    N = int((tf - t0) / h + 1e-9) + 1  # Tolerance so that e.g. 0.3 / 0.1 gives 3 steps
+    return t0 + h * np.arange(N)
+
+def richardson_extrapolation(x_coarse, x_fine, order):
+    """
+    Combine runs with step sizes 2h (x_coarse) and h (x_fine) of a method of the
+    given order into a result of higher order on the coarse grid.
+    The difference between the result and x_fine[::2] estimates the error of the fine run.
+    """
+    x_fine = x_fine[::2]
+    return x_fine + (x_fine - x_coarse) / (2 ** order - 1)
+
+def batch_method(f, t0, tf, x0_values, step_sizes, method, jac=None, split=None):
+    """
+    Integrate an ensemble of initial conditions for several step sizes in one pass.
+
+    All (h, x0) pairs are advanced together as a (len(step_sizes), len(x0_values))
+    array, or (len(step_sizes), len(x0_values), n) for systems, so f must accept
+    array arguments. Each row stops at the end of its own grid, so the batch
+    shrinks as the coarser step sizes finish.
+    Returns a dict mapping each step size to (t_values, x_values), where x_values
+    has shape (len(t_values), len(x0_values)) or (len(t_values), len(x0_values), n).
+    Implicit methods use the vectorized Jacobian jac from equations.compile_jacobian,
+    or finite differences without one. Symplectic methods use the velocity
+    and force halves split, e.g. from equations.compile_hamiltonian_split.
+    """
+    step = step_functions[method]
+    x0_values = np.asarray(x0_values, dtype=float)
+    if method in implicit_methods:
+        if jac is None:
+            jac = partial(finite_difference_jacobian, f, system=x0_values.ndim > 1)
+        step = partial(step, jac=jac)
+    elif method in symplectic_methods:
+        step = partial(step, split=split)
+    grids = [time_grid(t0, tf, step_size) for step_size in step_sizes]
+    # Rows run from the longest grid to the shortest, so the unfinished ones are always a leading slice
+    order = sorted(range(len(step_sizes)), key=lambda i: -len(grids[i]))
+    steps = [len(grids[i]) - 1 for i in order]
+    # Step sizes broadcast against the (len(x0_values), ...) state of each row
+    h = np.asarray([step_sizes[i] for i in order], dtype=float).reshape((len(order),) + (1,) * x0_values.ndim)
+
+    x = np.empty((steps[0] + 1, len(step_sizes)) + x0_values.shape)
+    x[0] = x0_values
+    active = len(steps)
+    for n in range(steps[0]):
+        while steps[active - 1] <= n:
+            active -= 1
+        x[n+1, :active] = step(f, t0 + n * h[:active], x[n, :active], h[:active])
+
+    rows = {i: row for row, i in enumerate(order)}
+    return {step_size: (grid, x[:len(grid), rows[i]]) for i, (step_size, grid) in enumerate(zip(step_sizes, grids))}
+
+# Embedded Runge-Kutta pairs: the solution advances with b (order 'order') and
+# b_hat gives the lower order estimate used for error control
+embedded_pairs = {
+    'Heun-Euler': {
+        'order': 2,
+        'c': [0, 1],
+        'A': [[], [1]],
+        'b': [1/2, 1/2],
+        'b_hat': [1, 0],
+    },
+    'Bogacki-Shampine': {
+        'order': 3,
+        'c': [0, 1/2, 3/4, 1],
+        'A': [[], [1/2], [0, 3/4], [2/9, 1/3, 4/9]],
+        'b': [2/9, 1/3, 4/9, 0],
+        'b_hat': [7/24, 1/4, 1/3, 1/8],
+    },
+    'Dormand-Prince': {
+        'order': 5,
+        'c': [0, 1/5, 3/10, 4/5, 8/9, 1, 1],
+        'A': [
+            [],
+            [1/5],
+            [3/40, 9/40],
+            [44/45, -56/15, 32/9],
+            [19372/6561, -25360/2187, 64448/6561, -212/729],
+            [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+            [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84],
+        ],
+        'b': [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84, 0],
+        'b_hat': [5179/57600, 0, 7571/16695, 393/640, -92097/339200, 187/2100, 1/40],
+    },
+}
+
+def adaptive_method(f, t0, tf, x0, pair, rtol=1e-6, atol=1e-9, h0=None, max_steps=100000):
+    """
+    Integrate from t0 to tf with an embedded Runge-Kutta pair and error control.
+
+    Each step is accepted when the RMS of the local error estimate, scaled by
+    atol + rtol * |x|, is at most one; the next step size follows the standard
+    controller with safety factor 0.9.
+    Returns (t_values, x_values, h_values), where h_values holds the accepted steps.
+    """
+    tableau = embedded_pairs[pair]
+    c, A = tableau['c'], tableau['A']
+    b = np.array(tableau['b'])
+    b_err = b - np.array(tableau['b_hat'])
+    exponent = 1 / tableau['order']  # Error estimate is of the lower order, order - 1
+
+    x = np.asarray(x0, dtype=float)
+    t = t0
+    h = h0 if h0 is not None else (tf - t0) / 100
+    t_values, x_values, h_values = [t0], [x], []
+    k = np.empty((len(c),) + x.shape)
+
+    attempts = 0
+    while t < tf:
+        attempts += 1
+        if attempts > max_steps:
+            raise RuntimeError(f"{pair} exceeded {max_steps} steps before reaching tf")
+        h = min(h, tf - t)
+        for i in range(len(c)):
+            k[i] = f(t + c[i] * h, x + h * np.tensordot(A[i], k[:i], axes=1))
+        x_new = x + h * np.tensordot(b, k, axes=1)
+        scale = atol + rtol * np.maximum(np.abs(x), np.abs(x_new))
+        error = np.sqrt(np.mean((h * np.tensordot(b_err, k, axes=1) / scale) ** 2))
+
+        if error <= 1:
+            t, x = t + h, x_new
+            t_values.append(t)
+            x_values.append(x)
+            h_values.append(h)
+        factor = 5.0 if error == 0 else min(5.0, max(0.2, 0.9 * error ** -exponent))
+        h *= factor
+
+    return np.array(t_values), np.array(x_values), np.array(h_values)
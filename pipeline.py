@@ -0,0 +1,308 @@
+# pipeline.py
+
+import numpy as np
+from functools import partial
+from equations import (
+    compile_jit_equation, compile_jacobian, compile_hamiltonian_split, compile_quantity, compile_parametric, split_system,
+)
+from solvers import dynamic_ode_function, reference_values, default_reference
+from methods import (
+    batch_method, method_functions, method_stages, method_orders, implicit_methods, symplectic_methods,
+    adaptive_method, embedded_pairs, time_grid, richardson_extrapolation,
+)
+from utils import percent_error
+from cache import cache_key, array_digest, load_arrays, save_arrays
+from instrumentation import CountingFunction, counted_options, timed, count
+
+def get_reference(equation_str, x0, t0, grids, reference=None):
+    """
+    Reference solution on each of the given time grids, in the same order.
+
+    Every grid is cached on disk by its content and the reference settings
+    (solver, rtol, atol; see solvers.default_reference). Grids missing from the
+    cache are solved together with a single solve_ivp call on their union.
+    """
+    reference = {**default_reference, **(reference or {})}
+    options = tuple(sorted(reference.items()))
+    keys = [cache_key('reference', equation_str, x0, t0, options, array_digest(grid)) for grid in grids]
+    values = [load_arrays(key) for key in keys]
+
+    missing = [i for i, arrays in enumerate(values) if arrays is None]
+    if missing:
+        t_union = np.unique(np.concatenate([grids[i] for i in missing]))
+        with timed('parse'):
+            rhs = CountingFunction(dynamic_ode_function(equation_str))
+        with timed('reference_solve'):
+            x_union = reference_values(rhs, t0, x0, t_union, reference['solver'], reference['rtol'], reference['atol'])
+        count('reference_solves')
+        count('reference_rhs_evaluations', rhs.calls)
+        for i in missing:
+            values[i] = {'x': x_union[np.searchsorted(t_union, grids[i])]}
+            save_arrays(keys[i], **values[i])
+
+    return [arrays['x'] for arrays in values]
+
+def get_reference_curve(equation_str, x0, t0, tf, step_sizes=(), reference=None):
+    """
+    Reference solution sampled on 1000 points for plotting.
+    The fixed-step grids for step_sizes are solved in the same pass, so later
+    trajectory error computations find them in the cache.
+    """
+    t_fine = np.linspace(t0, tf, 1000)
+    grids = [t_fine] + [time_grid(t0, tf, h) for h in step_sizes]
+    return t_fine, get_reference(equation_str, x0, t0, grids, reference)[0]
+
+def trajectory_key(equation_str, x0, t0, method, h):
+    """
+    Cache key of a fixed-step trajectory; tf is left out so that runs can be resumed.
+    """
+    return cache_key('trajectory', equation_str, x0, t0, method, h)
+
+def method_options(equation_str, method):
+    """
+    Keyword arguments a fixed-step method needs besides f: the symbolic
+    Jacobian for implicit methods, the velocity and force halves of the
+    system for symplectic ones.
+    """
+    if method in implicit_methods:
+        return {'jac': compile_jacobian(equation_str)}
+    if method in symplectic_methods:
+        return {'split': compile_hamiltonian_split(equation_str)}
+    return {}
+
+def get_trajectories(equation_str, x0, t0, tf, method, step_sizes, rtol, atol, use_jit, reference=None):
+    """
+    Return (h, name, t_values, x_values, x_real_at_steps) for every trajectory of a method.
+
+    Trajectories are cached on disk per (equation, x0, t0, method, h) without tf.
+    Only missing step sizes are integrated from t0, a trajectory cached up to an
+    earlier tf is resumed from its last state, and a longer one is truncated.
+    """
+    with timed('parse'):
+        ode_func = dynamic_ode_function(equation_str)
+
+    if method in embedded_pairs:
+        return [get_adaptive_trajectory(equation_str, ode_func, x0, t0, tf, method, rtol, atol, reference)]
+
+    grids = {h: time_grid(t0, tf, h) for h in step_sizes}
+    keys = {h: trajectory_key(equation_str, x0, t0, method, h) for h in step_sizes}
+    cached = {h: load_arrays(key) for h, key in keys.items()}
+    missing = [h for h in step_sizes if cached[h] is None]
+    resumed = [h for h in step_sizes if cached[h] is not None and len(cached[h]['x']) < len(grids[h])]
+    count('trajectory_cache_hits', len(step_sizes) - len(missing) - len(resumed))
+    count('trajectory_cache_misses', len(missing))
+    count('trajectory_cache_resumes', len(resumed))
+
+    jit_func = None
+    with timed('parse'):
+        options = method_options(equation_str, method)
+    # Newton iterations use the symbolic Jacobian; there are no compiled implicit loops
+    if method not in implicit_methods and use_jit and (missing or resumed):
+        with timed('parse'):
+            jit_func = compile_jit_equation(equation_str)
+    rhs = CountingFunction(ode_func)
+    step_options, split_evaluations = counted_options(options)
+    integrate = partial(method_functions[method], **step_options)
+
+    computed = {}
+    if missing:
+        if jit_func is not None:
+            # Compiled stepping loops, one per step size; compiled calls cannot be wrapped, so count them from the steps
+            with timed('stepping'):
+                for h in missing:
+                    computed[h] = integrate(jit_func, grids[h], x0, h)
+                    count('rhs_evaluations', (len(grids[h]) - 1) * method_stages[method])
+        else:
+            # Integrate all missing step sizes together in one vectorized pass;
+            # each call evaluates one state per step size that is still running
+            batch_rhs = CountingFunction(ode_func, batched=True)
+            batch_options, batch_split_evaluations = counted_options(options, batched=True)
+            with timed('stepping'):
+                for h, (t_values, x_values) in batch_method(batch_rhs, t0, tf, [x0], missing, method, **batch_options).items():
+                    computed[h] = x_values[:, 0]
+            count('rhs_evaluations', batch_rhs.calls + batch_split_evaluations())
+
+    for h in resumed:
+        # Continue from the last cached state over the remaining part of the grid
+        start = len(cached[h]['x']) - 1
+        with timed('stepping'):
+            x_tail = integrate(jit_func or rhs, grids[h][start:], cached[h]['x'][-1], h)
+        computed[h] = np.concatenate([cached[h]['x'], x_tail[1:]])
+        if jit_func is not None:
+            count('rhs_evaluations', (len(grids[h]) - 1 - start) * method_stages[method])
+    count('rhs_evaluations', rhs.calls + split_evaluations())
+
+    for h, x_values in computed.items():
+        cached[h] = {'x': x_values}
+        save_arrays(keys[h], **cached[h])
+
+    # One reference solve covers every grid that is not cached yet
+    x_real = get_reference(equation_str, x0, t0, [grids[h] for h in step_sizes], reference)
+    return [
+        (h, f'{method} (h={h})', grids[h], cached[h]['x'][:len(grids[h])], x_real_at_steps)
+        for h, x_real_at_steps in zip(step_sizes, x_real)
+    ]
+
+def get_adaptive_trajectory(equation_str, ode_func, x0, t0, tf, method, rtol, atol, reference=None):
+    """
+    Adaptive counterpart of get_trajectories for a single embedded pair.
+    The cached run is cut at the last accepted step before tf and integrated
+    onwards from there, so changing tf only costs the steps past that point.
+    """
+    key = cache_key('trajectory', equation_str, x0, t0, method, rtol, atol)
+    arrays = load_arrays(key)
+
+    if arrays is not None and arrays['t'][-1] == tf:
+        count('trajectory_cache_hits')
+    else:
+        if arrays is None:
+            count('trajectory_cache_misses')
+            arrays = {'t': np.array([t0]), 'x': np.asarray(x0, dtype=float)[None], 'h': np.array([])}
+        else:
+            count('trajectory_cache_resumes')
+            keep = max(int(np.searchsorted(arrays['t'], tf)), 1)
+            arrays = {'t': arrays['t'][:keep], 'x': arrays['x'][:keep], 'h': arrays['h'][:keep - 1]}
+
+        rhs = CountingFunction(ode_func)
+        h0 = arrays['h'][-1] if len(arrays['h']) else None
+        with timed('stepping'):
+            t_tail, x_tail, h_tail = adaptive_method(rhs, arrays['t'][-1], tf, arrays['x'][-1], method, rtol, atol, h0)
+        count('rhs_evaluations', rhs.calls)
+        arrays = {
+            't': np.concatenate([arrays['t'], t_tail[1:]]),
+            'x': np.concatenate([arrays['x'], x_tail[1:]]),
+            'h': np.concatenate([arrays['h'], h_tail]),
+        }
+        # Keep the longer run on disk so that shrinking tf again is a cheap cut
+        previous = load_arrays(key)
+        if previous is None or previous['t'][-1] <= tf:
+            save_arrays(key, **arrays)
+
+    x_real = get_reference(equation_str, x0, t0, [arrays['t']], reference)[0]
+    # Adaptive methods choose their own steps and report the mean accepted step size
+    return (np.mean(arrays['h']), f"{method} ({len(arrays['h'])} adaptive steps)", arrays['t'], arrays['x'], x_real)
+
+def select_step_size(equation_str, x0, t0, tf, method, target, statistic='Mean', coarse_steps=16):
+    """
+    Predict the largest step size whose mean or max percent error meets target.
+
+    Two cheap runs with (tf - t0) / coarse_steps and half that step give a
+    Richardson estimate of the error of the finer one. With the method's order
+    p the error scales as h**p, which gives the step size for the target.
+    The result divides tf - t0 into an even number of steps, so it can be
+    paired with 2h for extrapolation (see get_extrapolated_trajectory).
+    Returns (h, predicted error in percent).
+    """
+    order = method_orders[method]
+    span = tf - t0
+    with timed('parse'):
+        rhs = CountingFunction(dynamic_ode_function(equation_str))
+        options, split_evaluations = counted_options(method_options(equation_str, method))
+        integrate = partial(method_functions[method], **options)
+
+    h_coarse = span / coarse_steps
+    with timed('stepping'):
+        x_coarse = integrate(rhs, time_grid(t0, tf, h_coarse), x0, h_coarse)
+        x_fine = integrate(rhs, time_grid(t0, tf, h_coarse / 2), x0, h_coarse / 2)
+    count('rhs_evaluations', rhs.calls + split_evaluations())
+
+    with timed('errors'):
+        errors = percent_error(richardson_extrapolation(x_coarse, x_fine, order), x_fine[::2])
+        estimate = np.nanmax(errors) if statistic == 'Max' else np.nanmean(errors)
+    if not np.isfinite(estimate):
+        raise ValueError(f"Could not estimate the error of {method}; the coarse runs diverged")
+
+    if estimate > 0:
+        h_target = h_coarse / 2 * (target / estimate) ** (1 / order)
+    else:
+        h_target = span / 2
+    steps = max(2, 2 * int(np.ceil(span / h_target / 2)))
+    h = span / steps
+    return h, estimate * (2 * h / h_coarse) ** order
+
+def get_extrapolated_trajectory(equation_str, x0, t0, tf, method, h, reference=None):
+    """
+    Richardson extrapolation of the runs with step sizes h and 2h.
+    Returns (t_values, x_extrapolated, x_real_at_steps) on the grid of 2h.
+    """
+    (_, _, _, x_fine, _), (_, _, t_values, x_coarse, x_real) = get_trajectories(
+        equation_str, x0, t0, tf, method, [h, 2 * h], None, None, use_jit=True, reference=reference
+    )
+    return t_values, richardson_extrapolation(x_coarse, x_fine, method_orders[method]), x_real
+
+def error_statistics(x_real, x_values):
+    """
+    Mean and max percent error of a trajectory over every step and component,
+    or None when either is NaN.
+    """
+    with timed('errors'):
+        errors = percent_error(x_real, x_values)
+        mean_error = np.mean(errors)
+        max_error = np.max(errors)
+    if not (np.isnan(mean_error) or np.isnan(max_error)):
+        return mean_error, max_error
+    return None
+
+def conserved_drift(quantity_str, t_values, x_values):
+    """
+    Largest drift of a conserved quantity along a trajectory as (percent of
+    its initial value, absolute). The percentage is NaN when the initial value
+    is zero, and both are NaN when the quantity is.
+    """
+    n = x_values.shape[1] if x_values.ndim > 1 else 1
+    with timed('errors'):
+        time_axis = t_values[:, None] if x_values.ndim > 1 else t_values
+        values = compile_quantity(quantity_str, n)(time_axis, x_values)
+        drift = float(np.max(np.abs(values - values[0])))
+        percent = float(drift / abs(values[0]) * 100) if values[0] != 0 else np.nan
+    return percent, drift
+
+def parameter_sweep(equation_str, parameters, parameter_values, x0, t0, tf, method, h, sensitivities=False):
+    """
+    Integrate an equation with named parameters for every row of
+    parameter_values, an (m, k) grid in the order of parameters, as one
+    vectorized batch with a fixed-step explicit or symplectic method.
+
+    The equation is compiled once (see equations.compile_parametric) and the
+    result is cached on disk by the grid. With sensitivities, the forward
+    sensitivities dy/dp are integrated along with the states, starting from
+    zero since x0 does not depend on the parameters.
+    Returns (t_values, x_values, s_values): x_values has shape (N, m) or
+    (N, m, n) and s_values, dy/dp, has shape (N, m, k) or (N, m, n, k), or is
+    None without sensitivities.
+    """
+    if method in implicit_methods or method not in method_stages:
+        raise ValueError(f"Parameter sweeps need a fixed-step explicit or symplectic method, not {method}")
+    if sensitivities and method in symplectic_methods:
+        raise ValueError("Sensitivities cannot be integrated with symplectic methods")
+    parameters = tuple(parameters)
+    values = np.asarray(parameter_values, dtype=float).reshape(-1, len(parameters))
+    key = cache_key('sweep', equation_str, parameters, x0, t0, tf, method, h, sensitivities, array_digest(values))
+    cached = load_arrays(key)
+    if cached is not None:
+        count('sweep_cache_hits')
+        return cached['t'], cached['x'], cached.get('s')
+    count('sweep_cache_misses')
+
+    with timed('parse'):
+        f = compile_parametric(equation_str, parameters, sensitivities)
+    n = len(split_system(equation_str))
+    m, k = values.shape
+    x_start = np.broadcast_to(np.asarray(x0, dtype=float), (m,) + np.shape(x0))
+    if sensitivities:
+        x_start = np.concatenate([x_start.reshape(m, n), np.zeros((m, n * k))], axis=-1)
+
+    # Every state of the batch gets its own row of parameters
+    rhs = CountingFunction(lambda t, y: f(t, y, values))
+    with timed('stepping'):
+        t_values, x = batch_method(rhs, t0, tf, x_start, [h], method)[h]
+    count('rhs_evaluations', rhs.calls * m)
+
+    arrays = {'t': t_values, 'x': x}
+    if sensitivities:
+        states = x[..., :n]
+        arrays['x'] = states[..., 0] if n == 1 else states
+        s_shape = (len(t_values), m, k) if n == 1 else (len(t_values), m, n, k)
+        arrays['s'] = x[..., n:].reshape(s_shape)
+    save_arrays(key, **arrays)
+    return arrays['t'], arrays['x'], arrays.get('s')
@@ -0,0 +1,76 @@
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+# Rendered equations are shared by every deck and every run that uses the same directory
+CACHE_DIR = os.environ.get("PPT_LATEX_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ppt_latex"))
+
+# Rendering settings; they are part of the cache key
+FONT_SIZE = 12
+DPI = 300
+
+# Return the LaTeX code of every '$$...$$' line, in order
+def find_equations(lines):
+    equations = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith("$$") and line.endswith("$$") and len(line) > 4:
+            equations.append(line[2:-2].strip())
+    return equations
+
+def _cache_path(latex_code):
+    key = hashlib.sha256(repr((latex_code, FONT_SIZE, DPI)).encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, f"{key}.png")
+
+# Render LaTeX code with matplotlib's mathtext and return the PNG bytes
+def render_latex(latex_code):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(0.01, 0.01))
+    ax.text(0.5, 0.5, f"${latex_code}$", fontsize=FONT_SIZE, ha='center', va='center')
+    ax.axis('off')
+
+    buf = BytesIO()
+    plt.savefig(buf, format='png', bbox_inches='tight', transparent=True, dpi=DPI)
+    plt.close(fig)
+    return buf.getvalue()
+
+def _store(latex_code, png):
+    # Write next to the final path and rename, so readers never see a partial file
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(png)
+        os.replace(tmp_path, _cache_path(latex_code))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+# Render every equation missing from the cache, in parallel when there are several,
+# and return how many were rendered
+def prerender(latex_codes, workers=None):
+    missing = sorted({code for code in latex_codes if not os.path.exists(_cache_path(code))})
+    if len(missing) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            images = list(executor.map(render_latex, missing))
+    else:
+        images = [render_latex(code) for code in missing]
+    for code, png in zip(missing, images):
+        _store(code, png)
+    return len(missing)
+
+# PNG of an equation as a BytesIO, rendered only the first time it is seen
+def latex_image(latex_code):
+    path = _cache_path(latex_code)
+    try:
+        with open(path, "rb") as file:
+            return BytesIO(file.read())
+    except FileNotFoundError:
+        png = render_latex(latex_code)
+        _store(latex_code, png)
+        return BytesIO(png)
@@ -1,27 +1,14 @@
+import argparse
+import os
 from pptx import Presentation
 from pptx.util import Pt, Inches
 from pptx.dml.color import RGBColor
 import re
-import matplotlib.pyplot as plt
-from io import BytesIO
-from PIL import Image
+from latex_cache import find_equations, latex_image, prerender
 
-# Crear una nueva presentación
-prs = Presentation()
-
-# Function to convert LaTeX to an image and return the image path
+# Imagen PNG de una ecuación LaTeX; cada ecuación se renderiza una sola vez gracias al caché en disco
 def latex_to_image(latex_code):
-    fig, ax = plt.subplots(figsize=(0.01, 0.01))
-    ax.text(0.5, 0.5, f"${latex_code}$", fontsize=12, ha='center', va='center')
-    ax.axis('off')
-
-    # Save the image to a BytesIO object
-    buf = BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight', transparent=True, dpi=300)
-    plt.close(fig)
-    buf.seek(0)
-    
-    return buf
+    return latex_image(latex_code)
 
 # Función para añadir una diapositiva con un estilo general
 def add_slide(prs, title, content, title_font_size=32, content_font_size=24, background_color=None, title_color=RGBColor(0, 51, 102), content_color=RGBColor(0, 0, 0)):
@@ -77,70 +64,106 @@ def add_slide(prs, title, content, title_font_size=32, content_font_size=24, bac
             p.level = 0  # Regular paragraph
             p.text = paragraph_text
 
-# Leer el archivo de texto
-with open('contenido.txt', 'r', encoding='utf-8') as file:
-    lines = file.readlines()
-
-# Procesar el archivo de texto
-title = None
-subtitle = None
-current_slide_title = None
-current_slide_content = []
+# Añadir una diapositiva con el estilo que corresponde a su título
+def add_section_slide(prs, title, content):
+    if "Tarea" in title:
+        # Diferenciar visualmente las secciones de Tarea y Resolución de Tarea
+        add_slide(prs, title, content, background_color=RGBColor(255, 230, 204), title_color=RGBColor(102, 51, 0))
+    elif "Clase" in title:
+        # Diapositiva de inicio de clase con un estilo distinto
+        add_slide(prs, title, content, title_font_size=44, title_color=RGBColor(0, 102, 204), content_font_size=28, content_color=RGBColor(0, 0, 128))
+    else:
+        add_slide(prs, title, content)
+
+# Construir una presentación a partir de las líneas del archivo de texto y guardarla en output_path
+def build_presentation(lines, output_path):
+    # Crear una nueva presentación
+    prs = Presentation()
+
+    # Procesar el archivo de texto
+    title = None
+    subtitle = None
+    author = None
+    current_slide_title = None
+    current_slide_content = []
+
+    for line in lines:
+        line = line.strip()
+
+        if line.startswith("# Título:"):
+            title = line.replace("# Título:", "").strip()
+        elif line.startswith("# Subtítulo:"):
+            subtitle = line.replace("# Subtítulo:", "").strip()
+        elif line.startswith("# Autor:"):
+            author = line.replace("# Autor:", "").strip()
+        elif line.startswith("## "):  # Nueva diapositiva
+            if current_slide_title:
+                add_section_slide(prs, current_slide_title, current_slide_content)
+            current_slide_title = line.replace("## ", "").strip()
+            current_slide_content = []
+        elif line:  # Parte del contenido de la diapositiva
+            current_slide_content.append(line)
+
+    # Añadir la última diapositiva
+    if current_slide_title:
+        add_section_slide(prs, current_slide_title, current_slide_content)
+
+    # Crear la diapositiva de título
+    slide_layout = prs.slide_layouts[0]  # Diapositiva de título
+    slide = prs.slides.add_slide(slide_layout)
+    title_placeholder = slide.shapes.title
+    subtitle_placeholder = slide.placeholders[1]
 
-for line in lines:
-    line = line.strip()
-    
-    if line.startswith("# Título:"):
-        title = line.replace("# Título:", "").strip()
-    elif line.startswith("# Subtítulo:"):
-        subtitle = line.replace("# Subtítulo:", "").strip()
-    elif line.startswith("# Autor:"):
-        author = line.replace("# Autor:", "").strip()
-    elif line.startswith("## "):  # Nueva diapositiva
-        if current_slide_title:
-            if "Tarea" in current_slide_title:
-                # Diferenciar visualmente las secciones de Tarea y Resolución de Tarea
-                add_slide(prs, current_slide_title, current_slide_content, background_color=RGBColor(255, 230, 204), title_color=RGBColor(102, 51, 0))
-            elif "Clase" in current_slide_title:
-                # Diapositiva de inicio de clase con un estilo distinto
-                add_slide(prs, current_slide_title, current_slide_content, title_font_size=44, title_color=RGBColor(0, 102, 204), content_font_size=28, content_color=RGBColor(0, 0, 128))
-            else:
-                add_slide(prs, current_slide_title, current_slide_content)
-        current_slide_title = line.replace("## ", "").strip()
-        current_slide_content = []
-    elif line:  # Parte del contenido de la diapositiva
-        current_slide_content.append(line)
-
-# Añadir la última diapositiva
-if current_slide_title:
-    if "Tarea" in current_slide_title:
-        add_slide(prs, current_slide_title, current_slide_content, background_color=RGBColor(255, 230, 204), title_color=RGBColor(102, 51, 0))
-    elif "Clase" in current_slide_title:
-        add_slide(prs, current_slide_title, current_slide_content, title_font_size=44, title_color=RGBColor(0, 102, 204), content_font_size=28, content_color=RGBColor(0, 0, 128))
+    title_placeholder.text = title
+    title_placeholder.text_frame.paragraphs[0].font.size = Pt(44)
+    title_placeholder.text_frame.paragraphs[0].font.bold = True
+    title_placeholder.text_frame.paragraphs[0].font.color.rgb = RGBColor(0, 51, 102)
+
+    subtitle_placeholder.text = f"{subtitle}\n{author}"
+    subtitle_placeholder.text_frame.paragraphs[0].font.size = Pt(24)
+    subtitle_placeholder.text_frame.paragraphs[0].font.italic = True
+    subtitle_placeholder.text_frame.paragraphs[0].font.color.rgb = RGBColor(102, 102, 102)
+
+    # Mover la diapositiva de título al inicio
+    xml_slides = prs.slides._sldIdLst
+    slides = list(xml_slides)
+    xml_slides.remove(slides[-1])  # Mover la diapositiva de título al inicio
+    xml_slides.insert(0, slides[-1])
+
+    # Guardar la presentación
+    prs.save(output_path)
+
+# Construir varias presentaciones en un solo proceso: primero se renderizan en paralelo
+# todas las ecuaciones que aún no están en el caché, y luego cada presentación las reutiliza
+def build_presentations(input_paths, output_paths, workers=None):
+    decks = []
+    for input_path in input_paths:
+        with open(input_path, 'r', encoding='utf-8') as file:
+            decks.append(file.readlines())
+
+    prerender([equation for lines in decks for equation in find_equations(lines)], workers)
+
+    for lines, output_path in zip(decks, output_paths):
+        build_presentation(lines, output_path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera presentaciones .pptx a partir de archivos de texto.")
+    parser.add_argument('inputs', nargs='*', default=['contenido.txt'], help="archivos de texto (por defecto: contenido.txt)")
+    parser.add_argument('-o', '--output', help="archivo de salida para una sola entrada (por defecto: presentacion_generada.pptx)")
+    parser.add_argument('--output-dir', help="carpeta de salida; cada entrada genera <nombre>.pptx")
+    parser.add_argument('--workers', type=int, help="procesos para renderizar las ecuaciones")
+    args = parser.parse_args(argv)
+
+    if len(args.inputs) == 1 and not args.output_dir:
+        output_paths = [args.output or 'presentacion_generada.pptx']
+    elif args.output:
+        parser.error("--output solo sirve con una entrada; use --output-dir")
     else:
-        add_slide(prs, current_slide_title, current_slide_content)
-
-# Crear la diapositiva de título
-slide_layout = prs.slide_layouts[0]  # Diapositiva de título
-slide = prs.slides.add_slide(slide_layout)
-title_placeholder = slide.shapes.title
-subtitle_placeholder = slide.placeholders[1]
-
-title_placeholder.text = title
-title_placeholder.text_frame.paragraphs[0].font.size = Pt(44)
-title_placeholder.text_frame.paragraphs[0].font.bold = True
-title_placeholder.text_frame.paragraphs[0].font.color.rgb = RGBColor(0, 51, 102)
-
-subtitle_placeholder.text = f"{subtitle}\n{author}"
-subtitle_placeholder.text_frame.paragraphs[0].font.size = Pt(24)
-subtitle_placeholder.text_frame.paragraphs[0].font.italic = True
-subtitle_placeholder.text_frame.paragraphs[0].font.color.rgb = RGBColor(102, 102, 102)
-
-# Mover la diapositiva de título al inicio
-xml_slides = prs.slides._sldIdLst  
-slides = list(xml_slides)
-xml_slides.remove(slides[-1])  # Mover la diapositiva de título al inicio
-xml_slides.insert(0, slides[-1])
-
-# Guardar la presentación
-prs.save('presentacion_generada.pptx')
+        output_dir = args.output_dir or '.'
+        os.makedirs(output_dir, exist_ok=True)
+        output_paths = [os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + '.pptx') for path in args.inputs]
+
+    build_presentations(args.inputs, output_paths, args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,14 @@
+import argparse
+import os
 from pptx import Presentation
 from pptx.util import Pt, Inches
 from pptx.dml.color import RGBColor
 import re
-import matplotlib.pyplot as plt
-from io import BytesIO
+from latex_cache import find_equations, latex_image, prerender
 
-# Create a new presentation
-prs = Presentation()
-
-# Function to convert LaTeX to an image and return the image path
+# Function to get a LaTeX equation as a PNG image, rendered once and then served from the disk cache
 def latex_to_image(latex_code):
-    fig, ax = plt.subplots(figsize=(0.01, 0.01))
-    ax.text(0.5, 0.5, f"${latex_code}$", fontsize=12, ha='center', va='center')
-    ax.axis('off')
-
-    # Save the image to a BytesIO object
-    buf = BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight', transparent=True, dpi=300)
-    plt.close(fig)
-    buf.seek(0)
-    
-    return buf
+    return latex_image(latex_code)
 
 # Function to apply formatting to parts of a paragraph
 def apply_text_formatting(paragraph, text):
@@ -98,71 +86,106 @@ def add_slide(prs, title, content, title_font_size=32, content_font_size=24, bac
             p.level = 0  # Regular paragraph
             apply_text_formatting(p, paragraph_text)  # Apply mixed formatting
 
-# Read the text file
-with open('input.md', 'r', encoding='utf-8') as file:
-    lines = file.readlines()
-
-# Process the text file
-title = None
-subtitle = None
-author = None
-current_slide_title = None
-current_slide_content = []
+# Function to add a slide styled according to its title
+def add_section_slide(prs, title, content):
+    if "Tarea" in title:
+        # Differentiate visually the Task and Task Resolution sections
+        add_slide(prs, title, content, background_color=RGBColor(255, 230, 204), title_color=RGBColor(102, 51, 0))
+    elif "Clase" in title:
+        # Start of class slide with a different style
+        add_slide(prs, title, content, title_font_size=44, title_color=RGBColor(0, 102, 204), content_font_size=28, content_color=RGBColor(0, 0, 128))
+    else:
+        add_slide(prs, title, content)
+
+# Function to build a presentation from the lines of a markdown file and save it to output_path
+def build_presentation(lines, output_path):
+    # Create a new presentation
+    prs = Presentation()
+
+    # Process the text file
+    title = None
+    subtitle = None
+    author = None
+    current_slide_title = None
+    current_slide_content = []
+
+    for line in lines:
+        line = line.strip()
+
+        if line.startswith("# Título:"):
+            title = line.replace("# Título:", "").strip()
+        elif line.startswith("# Subtítulo:"):
+            subtitle = line.replace("# Subtítulo:", "").strip()
+        elif line.startswith("# Autor:"):
+            author = line.replace("# Autor:", "").strip()
+        elif line.startswith("## "):  # New slide
+            if current_slide_title:
+                add_section_slide(prs, current_slide_title, current_slide_content)
+            current_slide_title = line.replace("## ", "").strip()
+            current_slide_content = []
+        elif line:  # Part of the slide content
+            current_slide_content.append(line)
+
+    # Add the last slide
+    if current_slide_title:
+        add_section_slide(prs, current_slide_title, current_slide_content)
+
+    # Create the title slide
+    slide_layout = prs.slide_layouts[0]  # Title slide
+    slide = prs.slides.add_slide(slide_layout)
+    title_placeholder = slide.shapes.title
+    subtitle_placeholder = slide.placeholders[1]
 
-for line in lines:
-    line = line.strip()
-    
-    if line.startswith("# Título:"):
-        title = line.replace("# Título:", "").strip()
-    elif line.startswith("# Subtítulo:"):
-        subtitle = line.replace("# Subtítulo:", "").strip()
-    elif line.startswith("# Autor:"):
-        author = line.replace("# Autor:", "").strip()
-    elif line.startswith("## "):  # New slide
-        if current_slide_title:
-            if "Tarea" in current_slide_title:
-                # Differentiate visually the Task and Task Resolution sections
-                add_slide(prs, current_slide_title, current_slide_content, background_color=RGBColor(255, 230, 204), title_color=RGBColor(102, 51, 0))
-            elif "Clase" in current_slide_title:
-                # Start of class slide with a different style
-                add_slide(prs, current_slide_title, current_slide_content, title_font_size=44, title_color=RGBColor(0, 102, 204), content_font_size=28, content_color=RGBColor(0, 0, 128))
-            else:
-                add_slide(prs, current_slide_title, current_slide_content)
-        current_slide_title = line.replace("## ", "").strip()
-        current_slide_content = []
-    elif line:  # Part of the slide content
-        current_slide_content.append(line)
-
-# Add the last slide
-if current_slide_title:
-    if "Tarea" in current_slide_title:
-        add_slide(prs, current_slide_title, current_slide_content, background_color=RGBColor(255, 230, 204), title_color=RGBColor(102, 51, 0))
-    elif "Clase" in current_slide_title:
-        add_slide(prs, current_slide_title, current_slide_content, title_font_size=44, title_color=RGBColor(0, 102, 204), content_font_size=28, content_color=RGBColor(0, 0, 128))
+    title_placeholder.text = title
+    title_placeholder.text_frame.paragraphs[0].font.size = Pt(44)
+    title_placeholder.text_frame.paragraphs[0].font.bold = True
+    title_placeholder.text_frame.paragraphs[0].font.color.rgb = RGBColor(0, 51, 102)
+
+    subtitle_placeholder.text = f"{subtitle}\n{author}"
+    subtitle_placeholder.text_frame.paragraphs[0].font.size = Pt(24)
+    subtitle_placeholder.text_frame.paragraphs[0].font.italic = True
+    subtitle_placeholder.text_frame.paragraphs[0].font.color.rgb = RGBColor(102, 102, 102)
+
+    # Move the title slide to the beginning
+    xml_slides = prs.slides._sldIdLst
+    slides = list(xml_slides)
+    xml_slides.remove(slides[-1])  # Move the title slide to the beginning
+    xml_slides.insert(0, slides[-1])
+
+    # Save the presentation
+    prs.save(output_path)
+
+# Function to build many presentations in one process: every equation missing from
+# the cache is rendered in parallel first, then each deck reuses the cached images
+def build_presentations(input_paths, output_paths, workers=None):
+    decks = []
+    for input_path in input_paths:
+        with open(input_path, 'r', encoding='utf-8') as file:
+            decks.append(file.readlines())
+
+    prerender([equation for lines in decks for equation in find_equations(lines)], workers)
+
+    for lines, output_path in zip(decks, output_paths):
+        build_presentation(lines, output_path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build .pptx presentations from markdown files.")
+    parser.add_argument('inputs', nargs='*', default=['input.md'], help="markdown files (default: input.md)")
+    parser.add_argument('-o', '--output', help="output file for a single input (default: output.pptx)")
+    parser.add_argument('--output-dir', help="output directory; each input becomes <name>.pptx")
+    parser.add_argument('--workers', type=int, help="processes used to render the equations")
+    args = parser.parse_args(argv)
+
+    if len(args.inputs) == 1 and not args.output_dir:
+        output_paths = [args.output or 'output.pptx']
+    elif args.output:
+        parser.error("--output only works with a single input; use --output-dir")
     else:
-        add_slide(prs, current_slide_title, current_slide_content)
-
-# Create the title slide
-slide_layout = prs.slide_layouts[0]  # Title slide
-slide = prs.slides.add_slide(slide_layout)
-title_placeholder = slide.shapes.title
-subtitle_placeholder = slide.placeholders[1]
-
-title_placeholder.text = title
-title_placeholder.text_frame.paragraphs[0].font.size = Pt(44)
-title_placeholder.text_frame.paragraphs[0].font.bold = True
-title_placeholder.text_frame.paragraphs[0].font.color.rgb = RGBColor(0, 51, 102)
-
-subtitle_placeholder.text = f"{subtitle}\n{author}"
-subtitle_placeholder.text_frame.paragraphs[0].font.size = Pt(24)
-subtitle_placeholder.text_frame.paragraphs[0].font.italic = True
-subtitle_placeholder.text_frame.paragraphs[0].font.color.rgb = RGBColor(102, 102, 102)
-
-# Move the title slide to the beginning
-xml_slides = prs.slides._sldIdLst  
-slides = list(xml_slides)
-xml_slides.remove(slides[-1])  # Move the title slide to the beginning
-xml_slides.insert(0, slides[-1])
-
-# Save the presentation
-prs.save('output.pptx')
+        output_dir = args.output_dir or '.'
+        os.makedirs(output_dir, exist_ok=True)
+        output_paths = [os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + '.pptx') for path in args.inputs]
+
+    build_presentations(args.inputs, output_paths, args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,45 @@
-from scipy.integrate import solve_ivp
 import numpy as np
+from equations import compile_equation
 
-def real_solution(t0, tf, x0, ode_func):
+# Solvers offered for the reference solution; Radau, BDF and LSODA handle stiff problems
+reference_solvers = ['RK45', 'DOP853', 'LSODA', 'Radau', 'BDF']
+
+# Reference settings, tighter than solve_ivp's own defaults (rtol=1e-3, atol=1e-6)
+default_reference = {'solver': 'RK45', 'rtol': 1e-8, 'atol': 1e-10}
+
+def real_solution(t0, tf, x0, ode_func, solver='RK45', rtol=1e-3, atol=1e-6):
     """
     Solve the ODE using an accurate solver (e.g., RK45) and return the solution.
+    x0 is a scalar for a single equation or a sequence for a system.
     """
-    sol = solve_ivp(ode_func, [t0, tf], [x0], dense_output=True, method='RK45')
+    from scipy.integrate import solve_ivp
+    sol = solve_ivp(ode_func, [t0, tf], np.atleast_1d(x0), dense_output=True, method=solver, rtol=rtol, atol=atol)
     return sol
 
+def reference_values(ode_func, t0, x0, t_eval, solver='RK45', rtol=1e-8, atol=1e-10):
+    """
+    Solve the ODE once from t0 to the last of the sorted times t_eval and return
+    the solution at exactly those times, without building a dense interpolant.
+    The layout matches the numerical methods: (N,) for a scalar x0, (N, n) for a system.
+    SciPy is imported on the first call, which keeps it out of the startup path.
+    """
+    from scipy.integrate import solve_ivp
+    sol = solve_ivp(ode_func, [t0, t_eval[-1]], np.atleast_1d(x0), t_eval=t_eval, method=solver, rtol=rtol, atol=atol)
+    if not sol.success:
+        raise RuntimeError(f"Reference solver {solver} failed: {sol.message}")
+    return sol.y[0] if np.ndim(x0) == 0 else sol.y.T
+
+def evaluate_solution(sol, t_values, x0):
+    """
+    Evaluate the dense reference solution with the same layout as the numerical
+    methods: shape (N,) for a scalar x0 and (N, n) for a system.
+    """
+    values = sol.sol(t_values)
+    return values[0] if np.ndim(x0) == 0 else values.T
+
 def dynamic_ode_function(equation_str):
     """
     Convert an ODE string into a callable Python function for numerical methods.
+    The string is parsed and compiled once; repeated calls reuse the cached function.
     """
-    return lambda t, y: eval(equation_str, {"t": t, "y": y, "np": np})
+    return compile_equation(equation_str)
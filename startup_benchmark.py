@@ -0,0 +1,101 @@
+# startup_benchmark.py
+
+"""
+Cold-start benchmark: how long a fresh interpreter takes to import each
+module of the app, as a new Streamlit worker or process pool worker does.
+
+Every measurement runs in its own Python process, so nothing is shared with
+earlier imports. The import time is the best of several repeats. It is
+reported next to the heaviest top-level packages it pulled in, read from
+python -X importtime.
+
+Usage:
+    python startup_benchmark.py --output bench
+    python startup_benchmark.py --output bench --baseline bench/startup.csv
+
+With --baseline, modules whose import got slower than the baseline by more
+than --max-slowdown are reported and the exit status is 1.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import pandas as pd
+
+# Entry points of the app, the CLI and the background workers
+default_modules = ['equations', 'methods', 'solvers', 'utils', 'pipeline', 'streaming', 'jobs', 'cli', 'app']
+
+def import_seconds(module):
+    """
+    Wall time of 'import module' in a fresh interpreter, excluding interpreter startup.
+    """
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(result.stdout.strip().splitlines()[-1])
+
+def heaviest_imports(module, top=5):
+    """
+    The top-level packages with the largest cumulative import time, as
+    (package, seconds), from python -X importtime.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], capture_output=True, text=True,
+                            check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    # Imports are listed after the ones they triggered, each level indented by two more spaces
+    packages = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            if name.strip() == module:
+                break
+            packages = []  # Imported at interpreter startup
+        elif depth == 1:
+            packages.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(packages, key=lambda package: -package[1])[:top]
+
+def run_benchmark(modules, repeats):
+    rows = []
+    for module in modules:
+        seconds = min(import_seconds(module) for _ in range(repeats))
+        heaviest = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in heaviest_imports(module))
+        rows.append({'module': module, 'seconds': seconds, 'heaviest_imports': heaviest})
+    return pd.DataFrame(rows)
+
+def compare_with_baseline(df, baseline, max_slowdown):
+    """
+    Return the modules whose import time grew by more than max_slowdown against the baseline.
+    """
+    merged = df.merge(baseline, on='module', suffixes=('', '_baseline'))
+    merged['slowdown'] = merged['seconds'] / merged['seconds_baseline']
+    return merged[merged['slowdown'] > max_slowdown]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time benchmark for cold workers.")
+    parser.add_argument('--modules', nargs='+', default=default_modules, help="modules to import")
+    parser.add_argument('--repeats', type=int, default=5, help="timing repeats, the best one is kept")
+    parser.add_argument('--output', default='benchmark_results', help="directory for the CSV")
+    parser.add_argument('--baseline', help="previous startup.csv to check for import-time regressions")
+    parser.add_argument('--max-slowdown', type=float, default=1.5)
+    args = parser.parse_args(argv)
+
+    df = run_benchmark(args.modules, args.repeats)
+    os.makedirs(args.output, exist_ok=True)
+    df.to_csv(os.path.join(args.output, 'startup.csv'), index=False)
+
+    with pd.option_context('display.max_colwidth', None):
+        print(df.to_string(index=False))
+
+    if args.baseline:
+        regressions = compare_with_baseline(df, pd.read_csv(args.baseline), args.max_slowdown)
+        if not regressions.empty:
+            print(f"\nImports slower than baseline by more than {args.max_slowdown}x:")
+            print(regressions[['module', 'seconds', 'seconds_baseline', 'slowdown']].to_string(index=False))
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
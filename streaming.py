@@ -0,0 +1,129 @@
+# streaming.py
+
+import os
+import numpy as np
+from methods import method_functions, method_stages
+from solvers import reference_values, default_reference
+from utils import percent_error
+from instrumentation import CountingFunction, counted_options, count, timed
+
+class RunningErrorStats:
+    """
+    Mean and max percent error accumulated chunk by chunk in constant memory.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def update(self, errors):
+        if errors.size:
+            self.count += errors.size
+            self.total += float(np.sum(errors))
+            self.max = max(self.max, float(np.max(errors)))
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else float('nan')
+
+def stream_trajectory(f, t0, tf, x0, h, method, chunk_size=100000, reference=None, stats=None, step_f=None, method_options=None):
+    """
+    Integrate with a fixed-step method and yield (t, x, x_real, errors) chunks
+    of at most chunk_size points, so memory does not grow with the horizon.
+
+    The time grid matches methods.time_grid. Each chunk continues from the
+    last state of the previous one, and so does the reference solution, which
+    is solved chunk by chunk with solve_ivp. Pass reference=False to skip the
+    reference; x_real and errors are then None. A RunningErrorStats passed as
+    stats is updated with every chunk. step_f, e.g. a Numba function from
+    equations.compile_jit_equation, replaces f in the stepping loop only.
+    method_options are keyword arguments of the method, such as the Jacobian
+    of an implicit method (see pipeline.method_options).
+    Stepping and reference solves are timed as 'stepping' and 'reference_solve',
+    and their right-hand side evaluations are counted chunk by chunk as
+    'rhs_evaluations' and 'reference_rhs_evaluations'.
+    """
+    steps = int((tf - t0) / h + 1e-9)
+    options = {**default_reference, **(reference or {})}
+    x_last = np.asarray(x0, dtype=float)
+    x_ref_last = x_last
+
+    begin = 0
+    while True:
+        end = min(begin + chunk_size, steps)
+        # The chunk grid starts at the previous chunk's last point, which is not yielded again
+        t_chunk = t0 + h * np.arange(begin, end + 1)
+        rhs = CountingFunction(f)
+        step_options, split_evaluations = counted_options(method_options or {})
+        with timed('stepping'):
+            x_chunk = method_functions[method](step_f or rhs, t_chunk, x_last, h, **step_options)
+        if step_f is not None:
+            # Compiled calls cannot be wrapped, so count them from the steps
+            count('rhs_evaluations', (end - begin) * method_stages[method])
+        else:
+            count('rhs_evaluations', rhs.calls + split_evaluations())
+        x_last = x_chunk[-1]
+
+        if reference is False:
+            x_real = errors = None
+        else:
+            reference_rhs = CountingFunction(f)
+            with timed('reference_solve'):
+                x_real = reference_values(reference_rhs, t_chunk[0], x_ref_last, t_chunk, options['solver'], options['rtol'], options['atol'])
+            count('reference_solves')
+            count('reference_rhs_evaluations', reference_rhs.calls)
+            x_ref_last = x_real[-1]
+
+        if begin > 0:
+            t_chunk, x_chunk = t_chunk[1:], x_chunk[1:]
+            x_real = x_real[1:] if x_real is not None else None
+        if x_real is not None:
+            errors = percent_error(x_real, x_chunk)
+            if stats is not None:
+                stats.update(errors)
+
+        yield t_chunk, x_chunk, x_real, errors
+        if end == steps:
+            break
+        begin = end
+
+def integrate_streaming(f, t0, tf, x0, h, method, chunk_size=100000, reference=None, spill_dir=None, step_f=None, method_options=None):
+    """
+    Run stream_trajectory to the end and return its RunningErrorStats.
+
+    With spill_dir, the full t, x, reference and error arrays are written
+    chunk by chunk into memory-mapped .npy files in that directory (they can
+    be reopened with np.load(..., mmap_mode='r')). Without it nothing but the
+    running statistics is kept.
+    """
+    stats = RunningErrorStats()
+    chunks = stream_trajectory(f, t0, tf, x0, h, method, chunk_size, reference, stats, step_f, method_options)
+    if spill_dir is None:
+        for _ in chunks:
+            pass
+        return stats
+
+    os.makedirs(spill_dir, exist_ok=True)
+    n_points = int((tf - t0) / h + 1e-9) + 1
+    state_shape = np.shape(x0)
+    spill = {
+        't': np.lib.format.open_memmap(os.path.join(spill_dir, 't.npy'), mode='w+', shape=(n_points,)),
+        'x': np.lib.format.open_memmap(os.path.join(spill_dir, 'x.npy'), mode='w+', shape=(n_points,) + state_shape),
+    }
+    if reference is not False:
+        spill['x_real'] = np.lib.format.open_memmap(os.path.join(spill_dir, 'x_real.npy'), mode='w+', shape=(n_points,) + state_shape)
+        spill['errors'] = np.lib.format.open_memmap(os.path.join(spill_dir, 'errors.npy'), mode='w+', shape=(n_points,) + state_shape)
+
+    position = 0
+    for t_chunk, x_chunk, x_real, errors in chunks:
+        end = position + len(t_chunk)
+        spill['t'][position:end] = t_chunk
+        spill['x'][position:end] = x_chunk
+        if x_real is not None:
+            spill['x_real'][position:end] = x_real
+            spill['errors'][position:end] = errors
+        position = end
+
+    for array in spill.values():
+        array.flush()
+    return stats
@@ -1,14 +1,12 @@
 # utils.py
 
+import hashlib
+import os
 import numpy as np
-import pandas as pd
-import streamlit as st
 from io import BytesIO
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle, Spacer, Image
+from concurrent.futures import ProcessPoolExecutor
+from instrumentation import timed, count
+from cache import cache_key, load_arrays, save_arrays
 
 
 def percent_error(real_values, numerical_values):
@@ -20,26 +18,97 @@ def percent_error(real_values, numerical_values):
     error[np.isnan(error)] = 0  # Handle NaN cases
     return error
 
-def compare_methods(error_stats_dict):
+def lttb_indices(x, y, n_out):
     """
-    Compare the mean and max errors across different methods and step sizes.
+    Indices of the points kept by Largest-Triangle-Three-Buckets downsampling.
+    The first and last points are always kept; every bucket in between keeps
+    the point forming the largest triangle with the previously kept point and
+    the average of the next bucket, which preserves the visual shape.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+def minmax_indices(y, n_buckets):
+    """
+    Indices of the first, last, minimum and maximum point of each of n_buckets
+    equal buckets, so spikes survive downsampling.
+    """
+    n = len(y)
+    if 2 * n_buckets + 2 >= n:
+        return np.arange(n)
+
+    size = -(-n // n_buckets)
+    padded = np.pad(y, (0, size * n_buckets - n), mode='edge').reshape(n_buckets, size)
+    offsets = np.arange(n_buckets) * size
+    candidates = [[0, n - 1], offsets + np.argmin(padded, axis=1), offsets + np.argmax(padded, axis=1)]
+    return np.unique(np.minimum(np.concatenate(candidates), n - 1))
+
+def downsample(x, y, max_points, method='LTTB'):
+    """
+    Reduce a trace to about max_points points for plotting.
+    method is 'LTTB', 'Min-Max' or 'None'; the full arrays are left untouched.
     """
+    if method == 'LTTB':
+        indices = lttb_indices(x, y, max_points)
+    elif method == 'Min-Max':
+        indices = minmax_indices(y, max_points // 2)
+    else:
+        return x, y
+    return x[indices], y[indices]
+
+def comparison_table(error_stats_dict):
+    """
+    Build a DataFrame with the mean and max errors of every method and step size.
+    """
+    import pandas as pd
     comparison_rows = []
     
     for method, stats in error_stats_dict.items():
-        for (step_size, mean_error, max_error) in stats:
+        # Rows may carry the percent and absolute drift of a conserved quantity
+        for (step_size, mean_error, max_error, *drift) in stats:
             if pd.notna(mean_error) and pd.notna(max_error):
-                comparison_rows.append({
+                row = {
                     'Method': method,
                     'Step Size': step_size,
                     'Mean Error (%)': round(mean_error, 2),
                     'Max Error (%)': round(max_error, 2)
-                })
+                }
+                if drift:
+                    row['Conserved Drift (%)'], row['Conserved Drift (abs)'] = drift
+                comparison_rows.append(row)
 
     if comparison_rows:
-        comparison_df = pd.DataFrame(comparison_rows)
-    else:
-        comparison_df = pd.DataFrame(columns=['Method', 'Step Size', 'Mean Error (%)', 'Max Error (%)'])
+        return pd.DataFrame(comparison_rows)
+    return pd.DataFrame(columns=['Method', 'Step Size', 'Mean Error (%)', 'Max Error (%)'])
+
+def best_methods(comparison_df):
+    """
+    Return the rows with the lowest mean error and the lowest max error.
+    """
+    min_mean_error_row = comparison_df.loc[comparison_df['Mean Error (%)'].idxmin()]
+    min_max_error_row = comparison_df.loc[comparison_df['Max Error (%)'].idxmin()]
+    return min_mean_error_row, min_max_error_row
+
+def compare_methods(error_stats_dict):
+    """
+    Compare the mean and max errors across different methods and step sizes.
+    """
+    import streamlit as st
+    comparison_df = comparison_table(error_stats_dict)
 
     st.markdown("## 🔍 Cross-Method Comparison")
     st.markdown("The following table compares the error statistics across the selected methods:")
@@ -47,15 +116,74 @@ def compare_methods(error_stats_dict):
 
     if not comparison_df.empty:
         st.markdown("### 📊 Insights from Comparison:")
-        min_mean_error_row = comparison_df.loc[comparison_df['Mean Error (%)'].idxmin()]
-        min_max_error_row = comparison_df.loc[comparison_df['Max Error (%)'].idxmin()]
+        min_mean_error_row, min_max_error_row = best_methods(comparison_df)
 
         st.write(f"- The method with the lowest **mean error** is `{min_mean_error_row['Method']}` with a step size of {min_mean_error_row['Step Size']} and a mean error of {min_mean_error_row['Mean Error (%)']}%.")
         st.write(f"- The method with the lowest **max error** is `{min_max_error_row['Method']}` with a step size of {min_max_error_row['Step Size']} and a max error of {min_max_error_row['Max Error (%)']}%.")
 
 
+def _render_png(figure_json):
+    """
+    Rasterize a Plotly figure given as JSON; runs inside the render worker processes.
+    """
+    import plotly.io as pio
+    return pio.from_json(figure_json).to_image(format="png")  # Ensure kaleido is installed for color images
+
+# Worker processes for figure rasterization, started on the first report and then reused
+_render_pool = None
+
+def _get_render_pool():
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+    return _render_pool
+
+def figure_images(figures):
+    """
+    Return PNG bytes for each Plotly figure.
+    Images are cached on disk by the figure's JSON, and the uncached ones are
+    rasterized in parallel in the worker pool.
+    """
+    specs = [fig.to_json() for fig in figures]
+    keys = [cache_key('figure_png', spec) for spec in specs]
+    images = [load_arrays(key) for key in keys]
+    images = [arrays['png'].tobytes() if arrays is not None else None for arrays in images]
+
+    missing = [i for i, image in enumerate(images) if image is None]
+    count('figure_cache_hits', len(figures) - len(missing))
+    if missing:
+        with timed('pdf_rasterize'):
+            if len(missing) == 1:
+                rendered = [_render_png(specs[missing[0]])]
+            else:
+                rendered = list(_get_render_pool().map(_render_png, [specs[i] for i in missing]))
+        for i, png in zip(missing, rendered):
+            images[i] = png
+            save_arrays(keys[i], png=np.frombuffer(png, dtype=np.uint8))
+
+    return images
+
 def create_pdf_report(equation_str, error_stats_dict, method_plots):
-    """Generate a PDF report using ReportLab."""
+    """
+    Generate a PDF report using ReportLab.
+    Reports are cached on disk by their equation, error tables and figures, so
+    an unchanged report is returned without rendering anything.
+    """
+    figures = list(method_plots.values())
+    images = figure_images(figures)
+    tables = tuple((method, tuple(tuple(float(value) for value in row) for row in error_stats_dict[method])) for method in method_plots)
+    report_key = cache_key('pdf_report', equation_str, tables, tuple(hashlib.sha256(image).hexdigest() for image in images))
+    cached = load_arrays(report_key)
+    if cached is not None:
+        count('report_cache_hits')
+        return BytesIO(cached['pdf'].tobytes())
+
+    # ReportLab is only needed here, so it is not imported with the module
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle, Spacer, Image
 
     # Create a BytesIO object to store the PDF
     pdf_output = BytesIO()
@@ -86,16 +214,14 @@ def create_pdf_report(equation_str, error_stats_dict, method_plots):
     elements.append(Spacer(1, 12))  # Add a spacer
 
     # Iterate over methods and add plots and error tables
-    for method, fig in method_plots.items():
+    for method, png in zip(method_plots, images):
         # Add method title
         method_title = Paragraph(f"<strong>{method} Method</strong>", normal_style)
         elements.append(method_title)
         elements.append(Spacer(1, 12))  # Add a spacer
 
-        # Save Plot as PNG and insert it into the PDF
-        img_buffer = BytesIO()
-        fig.write_image(img_buffer, format="png")  # Ensure kaleido is installed for color images
-        img_buffer.seek(0)
+        # Insert the rendered plot into the PDF
+        img_buffer = BytesIO(png)
 
         # Add image to the report
         img = Image(img_buffer, 7.5 * inch, 4.5 * inch)  # Adjust image size to use more space
@@ -104,8 +230,10 @@ def create_pdf_report(equation_str, error_stats_dict, method_plots):
 
         # Error Table for the method
         error_table_data = [["Step Size", "Mean Error (%)", "Max Error (%)"]]  # Table Header
+        if any(len(row) > 3 for row in error_stats_dict[method]):
+            error_table_data[0] += ["Conserved Drift (%)", "Conserved Drift (abs)"]
         for row in error_stats_dict[method]:
-            error_table_data.append([str(row[0]), f"{row[1]:.2f}", f"{row[2]:.2f}"])
+            error_table_data.append([str(row[0]), f"{row[1]:.2f}", f"{row[2]:.2f}"] + [f"{value:.2e}" for value in row[3:]])
 
         # Create table with styling
         error_table = Table(error_table_data)
@@ -122,7 +250,10 @@ def create_pdf_report(equation_str, error_stats_dict, method_plots):
         elements.append(Spacer(1, 24))  # Add a spacer after the table
 
     # Build the PDF
-    doc.build(elements)
+    with timed('pdf_build'):
+        doc.build(elements)
+
+    save_arrays(report_key, pdf=np.frombuffer(pdf_output.getvalue(), dtype=np.uint8))
 
     # Move cursor to start of the BytesIO object
     pdf_output.seek(0)